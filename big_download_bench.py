@@ -0,0 +1,499 @@
+"""
+Benchmarks big_download_poc on synthetic M01-M09 workbooks
+
+Generates workbooks with the sheets and headings the pipeline reads, at
+bench_scales times bench_base_projects projects, then runs every pipeline
+stage and export once per scale, reading the workbooks in this process,
+recording wall time, CPU time, peak traced memory and rows out. Results
+are appended to bench_history.csv in bench_dir so runs can be compared over
+time.
+
+python big_download_bench.py [scale ...]
+"""
+
+import pandas as pd
+import numpy as np
+import os
+import sys
+import json
+import time
+import shutil
+import datetime
+import functools
+import subprocess
+import tracemalloc
+
+import big_download_poc as bdp
+
+# Settings
+bench_dir = './bench'
+bench_base_projects = 100
+bench_scales = [1, 10, 100]
+bench_seed = 0
+# tracemalloc slows pandas down, so peaks and times come from separate runs
+bench_trace_memory = True
+
+_peak_stack = []
+
+report_sheet_extra = \
+    {'RLP - Baseline da...tput Report':
+         {'Number of baseline data sets collected and/or synthesised':
+              'count'},
+     'Baseline data Sta...inal Report':
+         {'Number of baseline data sets collected and/or synthesised':
+              'count'},
+     'RLP - Community e...tput Report':
+         {'Type of community/stakeholder engagement activity':'engagement',
+          'Purpose of engagement':'purpose',
+          'Number of community/stakeholder engagement type events':'count'},
+     'Community engagem...inal Report':
+         {'Type of community/stakeholder engagement activity':'engagement',
+          'Purpose of engagement':'purpose',
+          'Number of community/stakeholder engagement type events':'count'},
+     'RLP - Management ...tput Report':
+         {'CalculatedAreaHa':'area','AreaInvoicedHa':'area',
+          'Area (ha) covered by plan/s':'area','Type of plan':'plan',
+          'Are these plans new or revised?':'revision',
+          'Species and/or threatened ecological communities covered in plan':
+              'species',
+          'Number of plans developed':'count'},
+     'Management plan d...inal Report':
+         {'CalculatedAreaHa':'area','AreaInvoicedHa':'area',
+          'Area covered by plan (ha)':'area','Management plan type':'plan',
+          'Are these plans new or revised?':'revision',
+          'Species and/or threatened ecological communities covered in plan':
+              'species',
+          'Number of plans developed':'count'},
+     'Revegetation Deta...evegetation':
+         {'Area of revegetation works (Ha)':'area','No planted':'count',
+          'Revegetation method':'plan','Mature height':'plan',
+          'Species':'species'}}
+
+# columns in the real output reports that no extract reads
+report_unused_cols = \
+    ['Site Name','Photo Points','Comments','Reporting Officer',
+     'Invoice Number','Data Quality','Attachment','Latitude','Longitude']
+
+project_headings = \
+    ['Project ID','Grant ID','External ID','Internal order number',
+     'Work order id','Program','Sub-program','Name','Management Unit',
+     'Organisation','Status','Start Date','End Date','Contracted Start Date',
+     'Contracted End Date','Last Modified']
+
+engagement_types = \
+    ['Conferences / seminars','Field days',
+     'On-ground trials / demonstrations','On-ground works',
+     'One-on-one technical advice interactions','Training / workshop events']
+
+investment_priorities = \
+    ['Threatened Species A','Ramsar site B','TEC C','Soil D']
+
+
+def make_projects(n_projects:int,rng:np.random.Generator) -> pd.DataFrame:
+    """
+    Projects worksheet
+    Parameters
+    ----------
+    n_projects : int
+        number of projects.
+    rng : np.random.Generator
+        random numbers.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        projects with M01 headings.
+    """
+    ids = ['RLP-{:06d}'.format(i) for i in range(n_projects)]
+    return pd.DataFrame({
+        'Project ID':['pid{}'.format(i) for i in range(n_projects)],
+        'Grant ID':ids,
+        'External ID':['ext{}'.format(i) for i in range(n_projects)],
+        'Internal order number':['io{}'.format(i) for i in range(n_projects)],
+        'Work order id':['wo{}'.format(i) for i in range(n_projects)],
+        'Program':'Regional Land Partnerships',
+        'Sub-program':np.where(rng.random(n_projects) < 0.2,
+                               'State Government Emergency',
+                               'Regional Land Partnerships'),
+        'Name':['Project {}'.format(i) for i in range(n_projects)],
+        'Management Unit':rng.choice(['MU{}'.format(i) for i in range(50)],
+                                     n_projects),
+        'Organisation':rng.choice(['Org{}'.format(i) for i in range(200)],
+                                  n_projects),
+        'Status':rng.choice(['Active','Completed'],n_projects),
+        'Start Date':pd.Timestamp('2018-07-01'),
+        'End Date':pd.Timestamp('2023-06-30'),
+        'Contracted Start Date':pd.Timestamp('2018-07-01'),
+        'Contracted End Date':pd.Timestamp('2023-06-30'),
+        'Last Modified':pd.Timestamp('2022-07-01'),
+        'Service Provider':rng.choice(['SP1','SP2'],n_projects)})
+
+
+def make_report_sheet(projects:pd.DataFrame,extra:dict,n_rows:int,
+                      m_file:str,rng:np.random.Generator) -> pd.DataFrame:
+    """
+    One output report worksheet
+    Parameters
+    ----------
+    projects : pd.DataFrame
+        projects from make_projects.
+    extra : dict
+        measure column heading to kind of value.
+    n_rows : int
+        number of report rows.
+    m_file : str
+        M file reference, used in the activity ids.
+    rng : np.random.Generator
+        random numbers.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        report rows, duplicate headings numbered as pandas reads them.
+    """
+    df_out = projects.iloc[rng.integers(0,projects.shape[0],n_rows)]\
+        [project_headings].reset_index(drop=True)
+    df_out['Site ID'] = ['site{}'.format(i) for i in range(n_rows)]
+    df_out['Report Status'] = rng.choice(['Approved','Submitted'],n_rows)
+    df_out['Report Financial Year'] = rng.choice(bdp.financial_years,n_rows)
+    df_out['Stage'] = rng.choice(['Stage 1','Stage 2'],n_rows)
+    df_out['Activity ID'] = ['{}-act{}'.format(m_file,i)
+                             for i in range(n_rows)]
+    df_out['Activity Type'] = 'RLP Output Report'
+    df_out['Report From Date'] = pd.Timestamp('2019-07-01')
+    df_out['Report To Date'] = pd.Timestamp('2019-12-31')
+    df_out['Last Modified.1'] = pd.Timestamp('2020-01-01')
+    df_out['Last Modified.2'] = pd.Timestamp('2020-01-02')
+    for col in report_unused_cols:
+        df_out[col] = rng.choice(['a','b','c',None],n_rows)
+    values = {'count':lambda: rng.integers(0,4,n_rows),
+              'area':lambda: rng.random(n_rows) * 10,
+              'engagement':lambda: rng.choice(engagement_types,n_rows),
+              'purpose':lambda: rng.choice(['Inform','Consult'],n_rows),
+              'plan':lambda: rng.choice(['Farm','Site'],n_rows),
+              'revision':lambda: rng.choice(['New','Revised'],n_rows),
+              'species':lambda: rng.choice(['Koala; Bird',None,'Frog'],
+                                           n_rows)}
+    for col,kind in extra.items():
+        df_out[col] = values[kind]()
+    return df_out
+
+
+def write_report_workbook(fname:str,sheets:dict):
+    """
+    Writes report worksheets with two rows above the headings, as MERIT does
+    Parameters
+    ----------
+    fname : str
+        workbook filename.
+    sheets : dict
+        worksheet name to report rows.
+    """
+    with pd.ExcelWriter(fname) as writer:
+        for sheet_name,df_sheet in sheets.items():
+            headings = [col.split('.')[0] for col in df_sheet.columns]
+            pd.DataFrame([['MERIT download'],[fname]]).to_excel(
+                writer,sheet_name=sheet_name,index=False,header=False)
+            df_sheet.to_excel(writer,sheet_name=sheet_name,index=False,
+                              header=headings,startrow=2)
+
+
+def generate_workbooks(data_dir:str,n_projects:int,seed:int = 0):
+    """
+    Writes synthetic M01-M09 workbooks and lookup pickles for
+    big_download_poc.extract_date
+    Parameters
+    ----------
+    data_dir : str
+        output directory.
+    n_projects : int
+        number of projects.
+    seed : int, optional
+        random seed. The default is 0.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_dir,exist_ok=True)
+    suffix = ' ' + bdp.extract_date + '.xlsx'
+    projects = make_projects(n_projects,rng)
+    ids = projects['Grant ID'].to_numpy()
+    # the services of the procurement extracts of the generated worksheets
+    specs = bdp.extract_specs[
+        bdp.extract_specs['worksheet'].isin(list(report_sheet_extra)) &
+        bdp.extract_specs['service'].notnull()]
+    services = specs[['service','target_measure']].\
+        drop_duplicates().reset_index(drop=True)
+
+    # six services per project with targets by financial year
+    picks = np.argsort(rng.random((n_projects,services.shape[0])),axis=1)\
+        [:,:min(6,services.shape[0])]
+    targets = pd.DataFrame({
+        'Grant ID':np.repeat(ids,picks.shape[1]),
+        'Service':services['service'].to_numpy()[picks.ravel()],
+        'Target measure':services['target_measure'].to_numpy()[picks.ravel()],
+        'Total to be delivered':10})
+    for fy in bdp.financial_years:
+        targets[fy] = rng.integers(0,5,targets.shape[0])
+
+    n_secondary = rng.integers(0,3,n_projects)
+    outcome_ids = np.concatenate([ids,np.repeat(ids,n_secondary),ids])
+    outcomes = pd.DataFrame({
+        'Grant ID':outcome_ids,
+        'Type of outcomes':['Primary outcome'] * n_projects +
+            ['Secondary Outcome/s'] * int(n_secondary.sum()) +
+            ['Other'] * n_projects,
+        'Outcome':['Outcome {}'.format(i)
+                   for i in rng.integers(0,5,len(outcome_ids))],
+        'Investment Priority':[', '.join(rng.choice(investment_priorities,2,
+                                                    replace=False))
+                               for i in range(len(outcome_ids))]})
+    assets = pd.DataFrame({
+        'Grant ID':rng.choice(ids,2 * n_projects),
+        'Asset':rng.choice(['Koala','Wetland',None,'Bird'],2 * n_projects)})
+    meri_outcomes = pd.DataFrame({'Grant ID':np.repeat(ids,2)})
+    for col in dict.fromkeys(bdp.meri_outcomes_indicator_ref):
+        meri_outcomes[col.replace('_',' ').capitalize()] = \
+            rng.choice(['Yes',None],2 * n_projects)
+    meri_priorities = pd.DataFrame({
+        'Grant ID':rng.choice(ids,n_projects),
+        'Document name':rng.choice(['Doc1','Doc2',None],n_projects),
+        'Relevant section':'S1',
+        'Explanation of strategic alignment':'because'})
+    with pd.ExcelWriter(os.path.join(data_dir,'M01' + suffix)) as writer:
+        projects.to_excel(writer,sheet_name='Projects',index=False)
+        outcomes.to_excel(writer,sheet_name='RLP Outcomes',index=False)
+        targets.to_excel(writer,sheet_name='Project services and targets',
+                         index=False)
+        assets.to_excel(writer,sheet_name='MERI_Project Assets',index=False)
+        meri_outcomes.to_excel(writer,sheet_name='MERI_Outcomes',index=False)
+        meri_priorities.to_excel(writer,sheet_name='MERI_Priorities',
+                                 index=False)
+
+    n_rows = 3 * n_projects
+    m_files = sorted(set(
+        m_file for sheet_name,files_list in bdp.worksheet_files.items()
+        if sheet_name in report_sheet_extra or
+            sheet_name == 'RLP Output Report Adjustment'
+        for m_file in files_list))
+    for m_file in m_files:
+        sheets = {sheet_name:make_report_sheet(projects,
+                                               report_sheet_extra[sheet_name],
+                                               n_rows,m_file,rng)
+                  for sheet_name,files_list in bdp.worksheet_files.items()
+                  if m_file in files_list and sheet_name in report_sheet_extra}
+        if m_file in bdp.worksheet_files['RLP Output Report Adjustment']:
+            adjusted = services.iloc[rng.integers(0,services.shape[0],n_rows)]
+            sheets['RLP Output Report Adjustment'] = make_report_sheet(
+                projects,{},n_rows,m_file,rng)
+            sheets['RLP Output Report Adjustment']['Project Service'] = \
+                adjusted['service'].to_numpy()
+            sheets['RLP Output Report Adjustment']['Output Measure'] = \
+                adjusted['target_measure'].to_numpy()
+            sheets['RLP Output Report Adjustment'][
+                'Reported measure requiring adjustment'] = \
+                rng.integers(0,3,n_rows)
+            sheets['RLP Output Report Adjustment']['Adjustment'] = \
+                rng.integers(-2,3,n_rows)
+        write_report_workbook(os.path.join(data_dir,m_file + suffix),sheets)
+
+    management_units = pd.DataFrame({
+        'management_unit':['MU{}'.format(i) for i in range(50)],
+        'management_unit_id':range(50),
+        'management_unit_state':rng.choice(['NSW','VIC','QLD','SA','WA'],50),
+        'investment_priority_derived':'x','investment_priority':'y'})
+    management_units.to_pickle(os.path.join(data_dir,'management_units.pkl'))
+    pd.DataFrame({'management_unit_id':1,
+                  'investment_priority_derived':investment_priorities,
+                  'short_term_indicator':['Threatened Species','Ramsar',
+                                          'Threatened Ecological Community',
+                                          'Soil']}).\
+        to_pickle(os.path.join(data_dir,'investment_priority_themes.pkl'))
+    services.rename(columns={'service':'Service',
+                             'target_measure':'Target measure'}).\
+        to_pickle(os.path.join(data_dir,'all_project_services.pkl'))
+
+
+def frame_rows(output) -> int:
+    """
+    Rows in a stage output, summed over the frames of a dict output
+    """
+    if isinstance(output,dict):
+        return sum(frame_rows(value) for value in output.values())
+    return len(output) if isinstance(output,(pd.DataFrame,pd.Series,
+                                             bdp.ServiceTable)) else 0
+
+
+def timed(step:str,results:list,func):
+    """
+    Wraps func to append its wall time, CPU time, peak traced memory and
+    rows out to results
+    Parameters
+    ----------
+    step : str
+        step name.
+    results : list
+        list the measurements are appended to.
+    func : callable
+        function to time.
+    Returns
+    -------
+    wrapper : callable
+        timed func.
+    """
+    @functools.wraps(func)
+    def wrapper(*args,**kwargs):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            # timed steps nest (kernels inside stages), and each resets the
+            # peak, so enclosing steps take the max of their nested peaks
+            _peak_stack.append(0)
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            output = func(*args,**kwargs)
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            if tracing:
+                peak = max(tracemalloc.get_traced_memory()[1],
+                           _peak_stack.pop())
+                if _peak_stack:
+                    _peak_stack[-1] = max(_peak_stack[-1],peak)
+        results.append({
+            'step':step,
+            'wall_s':wall,
+            'cpu_s':cpu,
+            'peak_mb':peak / 2**20 if tracing else np.nan,
+            'rows':frame_rows(output)})
+        return output
+    return wrapper
+
+
+def run_pipeline(results:list) -> dict:
+    """
+    Runs every pipeline stage from a cold workbook cache, timing each stage,
+    the kernels inside them and each export
+    Parameters
+    ----------
+    results : list
+        list the measurements are appended to.
+    Returns
+    -------
+    outputs : dict
+        pipeline target outputs.
+    """
+    shutil.rmtree(bdp.workbook_cache_dir,ignore_errors=True)
+    bdp._workbook_manifests.clear()
+    stages = dict(bdp.pipeline_stages)
+    kernels = {name:getattr(bdp,name) for name in
+               ['load_mult_wbooks','extract_batch','conc_col',
+                'join_project_attributes']}
+    try:
+        for name,(func,inputs,files) in stages.items():
+            bdp.pipeline_stages[name] = (timed('stage:' + name,results,func),
+                                         inputs,files)
+        for name,func in kernels.items():
+            setattr(bdp,name,timed(name,results,func))
+        outputs = bdp.run_stages(bdp.pipeline_targets)
+        timed('stage:export_parquet',results,bdp.export_outputs)(outputs)
+        if bdp.xlsxwriter is not None:
+            timed('stage:export_excel',results,bdp.export_workbook)(outputs)
+        timed('stage:export_sqlite',results,bdp.export_database)(outputs)
+    finally:
+        bdp.pipeline_stages.update(stages)
+        for name,func in kernels.items():
+            setattr(bdp,name,func)
+    return outputs
+
+
+def summarise(results:list) -> pd.DataFrame:
+    """
+    Totals the measurements of each step (kernels run many times a stage)
+    """
+    df_out = pd.DataFrame(results)
+    return df_out.groupby('step',sort=False).agg(
+        calls=('wall_s','size'),wall_s=('wall_s','sum'),
+        cpu_s=('cpu_s','sum'),peak_mb=('peak_mb','max'),
+        rows=('rows','sum')).reset_index()
+
+
+def git_commit() -> str:
+    """
+    Current commit of the script, if it is in a git checkout
+    """
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],
+                              capture_output=True,text=True,
+                              cwd=os.path.dirname(os.path.abspath(
+                                  bdp.__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def bench_scale(scale:int) -> pd.DataFrame:
+    """
+    Benchmarks one scale, generating its workbooks on first use
+    Parameters
+    ----------
+    scale : int
+        multiple of bench_base_projects.
+    Returns
+    -------
+    summary : pd.DataFrame
+        one row per step.
+    """
+    n_projects = scale * bench_base_projects
+    data_dir = os.path.abspath(os.path.join(
+        bench_dir,'data_{}x_seed{}'.format(scale,bench_seed)))
+    if not os.path.exists(os.path.join(data_dir,'all_project_services.pkl')):
+        generate_workbooks(data_dir,n_projects,bench_seed)
+    cwd = os.getcwd()
+    settings = (bdp.use_stage_cache,bdp.workbook_cache_dir,bdp.export_dir,
+                bdp.ingest_workers,bdp.family_workers)
+    os.chdir(data_dir)
+    try:
+        bdp.use_stage_cache = False
+        # work in pool workers is missed by process_time and tracemalloc
+        bdp.ingest_workers = 1
+        bdp.family_workers = 1
+        bdp.workbook_cache_dir = os.path.join(data_dir,'workbook_cache')
+        bdp.export_dir = os.path.join(data_dir,'export')
+        results = []
+        run_pipeline(results)
+        summary = summarise(results)
+        if bench_trace_memory:
+            traced = []
+            tracemalloc.start()
+            try:
+                run_pipeline(traced)
+            finally:
+                tracemalloc.stop()
+            summary['peak_mb'] = summary['step'].map(
+                summarise(traced).set_index('step')['peak_mb'])
+    finally:
+        os.chdir(cwd)
+        bdp.use_stage_cache, bdp.workbook_cache_dir, bdp.export_dir, \
+            bdp.ingest_workers, bdp.family_workers = settings
+    summary.insert(0,'scale',scale)
+    summary.insert(1,'projects',n_projects)
+    return summary
+
+
+if __name__ == '__main__':
+    scales = [int(arg) for arg in sys.argv[1:]] or bench_scales
+    run_at = datetime.datetime.now().isoformat(timespec='seconds')
+    summary = pd.concat([bench_scale(scale) for scale in scales],
+                        ignore_index=True)
+    summary.insert(0,'run_at',run_at)
+    summary.insert(1,'commit',git_commit())
+    print(summary.to_string(index=False))
+    os.makedirs(bench_dir,exist_ok=True)
+    history_file = os.path.join(bench_dir,'bench_history.csv')
+    summary.to_csv(history_file,mode='a',index=False,
+                   header=not os.path.exists(history_file))
+    with open(os.path.join(bench_dir,'bench_' + run_at.replace(':','') +
+                           '.json'),'w') as f:
+        json.dump({'run_at':run_at,'commit':git_commit(),
+                   'settings':{name:getattr(bdp,name) for name in
+                               ['use_workbook_cache','schema_reads',
+                                'compact_dtypes',
+                                'compact_lineage','lazy_service_grid',
+                                'index_project_services']},
+                   'steps':summary.to_dict(orient='records')},
+                  f,indent=1,default=str)
@@ -7,12 +7,458 @@ This is a temporary script file.
 import pandas as pd
 from janitor import clean_names
 import itertools
+import functools
 import numpy as np
 import re
+import os
+import json
+import hashlib
+import inspect
+import types
+import multiprocessing
+import time
+import datetime
+import tracemalloc
+import sqlite3
+import contextlib
+import shutil
+import math
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+_workbook_manifests = {}
+# workbook key to worksheet names, when the workbook cache is off
+_workbook_sheets = {}
+# column name to the categories shared by every frame in compact_dtypes mode
+_category_registry = {}
+# one dict per profiled call while profile_calls is on
+_profile_records = []
+# read-only inputs of run_family, set in each family pool worker
+_family_context = {}
+# worker count to the pool reading M files, kept for the run
+_ingest_pools = {}
+
+profile_label_cols = ['worksheet','service','target_measure','sub_category',
+                      'detail']
+
+
+def joined_labels(values) -> str:
+    """
+    Distinct non null values joined with |, as a profile label
+    """
+    return '|'.join(str(value) for value in pd.unique(pd.Series(values))
+                    if pd.notna(value))
+
+
+def profiled(labels=None):
+    """
+    Decorator recording each call in _profile_records when profile_calls is
+    on: wall and CPU time, traced memory delta, input and output row counts
+    and labels. When off the call only costs a settings check.
+    Parameters
+    ----------
+    labels : callable, optional
+        takes the bound arguments of a call (a dict) and returns a dict of
+        profile_label_cols values. The default is None, no labels.
+    Returns
+    -------
+    decorate : callable
+        the decorator.
+    """
+    def decorate(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            if not profile_calls:
+                return func(*args,**kwargs)
+            arguments = signature.bind(*args,**kwargs).arguments
+            frames = [value for value in arguments.values()
+                      if isinstance(value,pd.DataFrame)]
+            record = dict.fromkeys(profile_label_cols)
+            if labels is not None:
+                record.update(labels(arguments))
+            # tracing slows everything traced, so it is only on while the
+            # outermost profiled call runs
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            try:
+                memory = tracemalloc.get_traced_memory()[0]
+                wall, cpu = time.perf_counter(), time.process_time()
+                df_out = func(*args,**kwargs)
+                wall, cpu = time.perf_counter() - wall, \
+                    time.process_time() - cpu
+                memory = tracemalloc.get_traced_memory()[0] - memory
+            finally:
+                if started:
+                    tracemalloc.stop()
+            record = dict(
+                call=func.__name__,
+                wall_s=wall,
+                cpu_s=cpu,
+                memory_delta_mb=memory / 2**20,
+                rows_in=frames[0].shape[0] if frames else None,
+                rows_out=getattr(df_out,'shape',[None])[0],
+                pid=os.getpid(),
+                **record)
+            _profile_records.append(record)
+            return df_out
+        return wrapper
+    return decorate
+
+
+def profiled_call(func_name:str,*args):
+    """
+    Runs a function of this script, returning its output and the profile
+    records of the call, so calls made in pool workers are not lost.
+    Parameters
+    ----------
+    func_name : str
+        function name.
+    *args :
+        the function arguments.
+    Returns
+    -------
+    output :
+        the function output.
+    records : list
+        profile records of the call.
+    """
+    start = len(_profile_records)
+    output = globals()[func_name](*args)
+    records = _profile_records[start:]
+    del _profile_records[start:]
+    return output, records
+
+
+def profile_summary(top_n:int = None,
+                    zero_rows:bool = False) -> pd.DataFrame:
+    """
+    Hot spots of the profiled calls: time, memory and rows totalled by call
+    and labels, most wall time first.
+    Parameters
+    ----------
+    top_n : int, optional
+        rows returned. The default is profile_top_n.
+    zero_rows : bool, optional
+        only calls and labels that returned no rows. The default is False.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        summary rows.
+    """
+    if top_n is None:
+        top_n = profile_top_n
+    df_in = pd.DataFrame(_profile_records,
+                         columns=['call'] + profile_label_cols +
+                         ['wall_s','cpu_s','memory_delta_mb','rows_in',
+                          'rows_out'])
+    df_out = df_in.groupby(['call'] + profile_label_cols,dropna=False).\
+        agg(calls=('wall_s','size'),wall_s=('wall_s','sum'),
+            cpu_s=('cpu_s','sum'),memory_delta_mb=('memory_delta_mb','sum'),
+            rows_in=('rows_in',lambda rows: rows.sum(min_count=1)),
+            rows_out=('rows_out',lambda rows: rows.sum(min_count=1))).\
+        reset_index()
+    if zero_rows:
+        df_out = df_out[df_out['rows_out'] == 0]
+    return df_out.sort_values('wall_s',ascending=False).head(top_n).\
+        reset_index(drop=True)
+
+
+def write_profile(path:str = None) -> str:
+    """
+    Writes the profiled calls as json (with run details) and csv, and
+    clears them.
+    Parameters
+    ----------
+    path : str, optional
+        file path without extension. The default is a timestamped name in
+        profile_dir.
+    Returns
+    -------
+    path : str
+        the path written to, without extension.
+    """
+    run_at = datetime.datetime.now().isoformat(timespec='seconds')
+    if path is None:
+        os.makedirs(profile_dir,exist_ok=True)
+        path = os.path.join(profile_dir,'profile_' + extract_date + '_' +
+                            run_at.replace(':',''))
+    df_out = pd.DataFrame(_profile_records)
+    df_out.to_csv(path + '.csv',index=False)
+    with open(path + '.json','w') as f:
+        json.dump({'run_at':run_at,'extract_date':extract_date,
+                   'version':version,
+                   'calls':df_out.astype(object).where(df_out.notna(),None).\
+                       to_dict(orient='records')},
+                  f,indent=1)
+    _profile_records.clear()
+    return path
+
+
+def workbook_key(fname:str,start_row:int = 2) -> str:
+    """
+    Cache key for a workbook
+    Parameters
+    ----------
+    fname : str
+        filename of workbook.
+    start_row : int, optional
+        rows to to skip before data. The default is 2.
+    Returns
+    -------
+    key : str
+        sha1 of the file path, size, modification time and header row.
+    """
+    stat = os.stat(fname)
+    key_text = '|'.join([os.path.abspath(fname), str(stat.st_size),
+                         str(stat.st_mtime_ns), str(start_row)])
+    return hashlib.sha1(key_text.encode('utf-8')).hexdigest()
+
+
+def parquet_safe(df_in:pd.DataFrame) -> pd.DataFrame:
+    """
+    Makes a worksheet dataframe writable to parquet. Column names become
+    strings and object columns holding mixed types (eg numbers and text in
+    the one column) are stored as text.
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        worksheet contents.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        parquet ready dataframe.
+    """
+    df_out = df_in.copy(deep=False)
+    df_out.columns = [str(col) for col in df_out.columns]
+    for col in df_out.columns[df_out.dtypes == object]:
+        if pd.api.types.infer_dtype(df_out[col], skipna=True).\
+                startswith('mixed'):
+            df_out[col] = df_out[col].where(df_out[col].isnull(),
+                                            df_out[col].astype(str))
+    return df_out
+
+
+def cache_workbook(fname:str,start_row:int = 2) -> dict:
+    """
+    Parses every worksheet in a workbook once and keeps each one on disk as
+    a parquet sidecar in workbook_cache_dir. Later calls for the same
+    unchanged file only read the manifest.
+    Parameters
+    ----------
+    fname : str
+        filename of workbook.
+    start_row : int, optional
+        rows to to skip before data. The default is 2.
+    Returns
+    -------
+    manifest : dict
+        worksheet name to parquet file path.
+    """
+    key = workbook_key(fname,start_row)
+    if key in _workbook_manifests:
+        return _workbook_manifests[key]
+    cache_path = os.path.join(workbook_cache_dir,key)
+    manifest_file = os.path.join(cache_path,'manifest.json')
+    if not os.path.exists(manifest_file):
+        tmp_path = cache_path + '.' + str(os.getpid()) + '.tmp'
+        os.makedirs(tmp_path,exist_ok=True)
+        sheets = pd.read_excel(fname,sheet_name=None,header=start_row)
+        manifest = {'fname':os.path.abspath(fname),'start_row':start_row,
+                    'sheets':{}}
+        for sheet_no, (sheet_name,df_sheet) in enumerate(sheets.items()):
+            sheet_file = 'sheet_{:03d}.parquet'.format(sheet_no)
+            parquet_safe(df_sheet).to_parquet(
+                os.path.join(tmp_path,sheet_file),index=False)
+            manifest['sheets'][sheet_name] = sheet_file
+        with open(os.path.join(tmp_path,'manifest.json'),'w') as f:
+            json.dump(manifest,f,indent=1)
+        try:
+            os.replace(tmp_path,cache_path)
+        except OSError:
+            # another process cached the same workbook first
+            pass
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    _workbook_manifests[key] = {
+        sheet_name:os.path.join(cache_path,sheet_file)
+        for sheet_name,sheet_file in manifest['sheets'].items()}
+    return _workbook_manifests[key]
+
+
+def workbook_cached(fname:str,start_row:int = 2) -> bool:
+    """
+    Whether a workbook is already in the workbook cache, so reading it is a
+    parquet read rather than a parse
+    Parameters
+    ----------
+    fname : str
+        filename of workbook.
+    start_row : int, optional
+        rows to to skip before data. The default is 2.
+    Returns
+    -------
+    cached : bool
+        True when use_workbook_cache is on and its manifest exists.
+    """
+    if not use_workbook_cache or not os.path.exists(fname):
+        return False
+    key = workbook_key(fname,start_row)
+    return key in _workbook_manifests or os.path.exists(
+        os.path.join(workbook_cache_dir,key,'manifest.json'))
+
+
+def workbook_sheets(fname:str) -> list:
+    """
+    Worksheet names of a workbook, from its cache manifest when
+    use_workbook_cache is on
+    Parameters
+    ----------
+    fname : str
+        filename of workbook.
+    Returns
+    -------
+    sheet_names : list
+        worksheet names, empty when the workbook does not exist.
+    """
+    if not os.path.exists(fname):
+        return []
+    if use_workbook_cache:
+        return list(cache_workbook(fname))
+    key = workbook_key(fname)
+    if key not in _workbook_sheets:
+        with pd.ExcelFile(fname) as workbook:
+            _workbook_sheets[key] = workbook.sheet_names
+    return _workbook_sheets[key]
+
+
+def read_lookup(name:str) -> pd.DataFrame:
+    """
+    Reads a lookup table from its pickle, renamed and with clean names
+    Parameters
+    ----------
+    name : str
+        lookup name, a key of lookup_files.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        lookup table.
+    """
+    return pd.read_pickle(lookup_files[name]).\
+        rename(lookup_renames.get(name,{}),axis=1).clean_names()
+
+
+def build_lookup(name:str) -> str:
+    """
+    Converts a lookup table once into an uncompressed Arrow IPC (feather)
+    file in lookup_store_dir, which can be memory mapped. The file is
+    rebuilt when its pickle, lookup_renames or the code reading and
+    cleaning it (read_lookup, clean_names and parquet_safe) changes.
+    Parameters
+    ----------
+    name : str
+        lookup name, a key of lookup_files.
+    Returns
+    -------
+    path : str
+        Arrow file path.
+    """
+    path = os.path.join(lookup_store_dir,name + '.arrow')
+    try:
+        clean_names_source = inspect.getsource(clean_names)
+    except (OSError,TypeError):
+        clean_names_source = repr(clean_names)
+    source_key = hashlib.sha1('|'.join(
+        [workbook_key(lookup_files[name],0),code_fingerprint(read_lookup),
+         code_fingerprint(parquet_safe),clean_names_source]).\
+        encode('utf-8')).hexdigest().encode('utf-8')
+    if os.path.exists(path):
+        with pa.memory_map(path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+        if metadata.get(b'source_key') == source_key:
+            return path
+    os.makedirs(lookup_store_dir,exist_ok=True)
+    table = pa.Table.from_pandas(parquet_safe(read_lookup(name)),
+                                 preserve_index=False)
+    table = table.replace_schema_metadata(
+        dict(table.schema.metadata or {},source_key=source_key))
+    tmp_file = path + '.' + str(os.getpid()) + '.tmp'
+    with pa.OSFile(tmp_file,'wb') as sink:
+        with pa.ipc.new_file(sink,table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_file,path)
+    return path
+
+
+def load_lookup(name:str,columns:list = None) -> pd.DataFrame:
+    """
+    Loads a lookup table. From the lookup store the file is memory mapped,
+    so only the pages of the columns asked for are read and processes
+    loading the same table share them through the page cache. Numeric
+    columns without nulls are not copied; text columns become python
+    strings as pandas needs them.
+    Parameters
+    ----------
+    name : str
+        lookup name, a key of lookup_files.
+    columns : list, optional
+        columns to load. The default is None, all columns.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        lookup table.
+    """
+    if not use_lookup_store or pa is None:
+        df_out = read_lookup(name)
+        return df_out if columns is None else df_out[columns]
+    with pa.memory_map(build_lookup(name)) as source:
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        return table.to_pandas(split_blocks=True)
+
+
+@functools.lru_cache(maxsize=None)
+def clean_column_name(col:str) -> str:
+    """
+    Column name as read_sheet returns it
+    Parameters
+    ----------
+    col : str
+        worksheet column heading.
+    Returns
+    -------
+    col_out : str
+        cleaned name, with grant_id as merit_project_id.
+    """
+    return pd.DataFrame(columns=[col]).\
+        clean_names(case_type='snake',strip_underscores=True).\
+        rename({'grant_id':'merit_project_id'},axis=1).columns[0]
 
-def read_sheet(sheet_name:str,fname:str,start_row:int = 2) -> pd.DataFrame:
+
+@profiled(lambda args: {'worksheet':args['sheet_name'],
+                         'detail':args['fname']})
+def read_sheet(sheet_name:str,fname:str,start_row:int = 2,
+               columns:list = None,numeric:list = None) -> pd.DataFrame:
     """
-    Reads a workbook and cleans headings
+    Reads a workbook and cleans headings to snake case, splitting camel case
+    words (CalculatedAreaHa as calculated_area_ha) as janitor does in R
     Parameters
     ----------
     sheet_name : str
@@ -21,222 +467,2429 @@ def read_sheet(sheet_name:str,fname:str,start_row:int = 2) -> pd.DataFrame:
         filename of workbook.
     start_row : int, optional
         rows to to skip before data. The default is 2.
+    columns : list, optional
+        cleaned names of the columns to read. Other columns are not parsed
+        (from the workbook) or not loaded (from the cache), and date_cols
+        among them are read as dates. The default is None, all columns.
+    numeric : list, optional
+        cleaned names of columns read as numbers, values that are not
+        numbers becoming NaN. The default is None.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        The contents of the worksheet in a dataframe.
+    """
+    if columns is not None:
+        wanted = set(columns)
+        keep_col = lambda col: clean_column_name(col) in wanted
+    if use_workbook_cache:
+        manifest = cache_workbook(fname,start_row)
+        if sheet_name not in manifest:
+            raise ValueError(
+                "Worksheet named '{}' not found in {}".format(sheet_name,
+                                                              fname))
+        if columns is not None and pa is not None:
+            sheet_cols = pq.read_schema(manifest[sheet_name]).names
+            df_out = pd.read_parquet(
+                manifest[sheet_name],
+                columns=[col for col in sheet_cols if keep_col(col)])
+        else:
+            df_out = pd.read_parquet(manifest[sheet_name])
+    else:
+        df_out = pd.read_excel(fname,sheet_name=sheet_name,header=start_row,
+                               usecols=None if columns is None else keep_col)
+    df_out = df_out.clean_names(case_type='snake',strip_underscores=True).\
+        rename({'grant_id':'merit_project_id'},axis=1)
+    if columns is not None:
+        df_out = df_out[[col for col in df_out.columns if col in wanted]]
+        for col in df_out.columns.intersection(date_cols):
+            df_out[col] = pd.to_datetime(df_out[col],errors='coerce')
+    for col in df_out.columns.intersection(numeric or []):
+        df_out[col] = pd.to_numeric(df_out[col],errors='coerce')
+    if compact_dtypes:
+        df_out = compact_categories(df_out)
+    return df_out
+
+
+def register_categories(df_in:pd.DataFrame,cols:list = None) -> list:
+    """
+    Adds the values of low cardinality text columns to _category_registry.
+    Columns holding values other than text (eg text and numbers mixed) are
+    left out, as their values cannot be sorted.
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        dataframe.
+    cols : list, optional
+        columns to register. The default is category_cols.
+    Returns
+    -------
+    registered : list
+        the columns registered.
+    """
+    if cols is None:
+        cols = category_cols
+    registered = []
+    for col in df_in.columns.intersection(cols):
+        if isinstance(df_in[col].dtype,pd.CategoricalDtype):
+            values = df_in[col].cat.categories
+        else:
+            values = pd.Index(df_in[col].dropna().unique())
+        if pd.api.types.infer_dtype(values,skipna=True) not in \
+                ['string','empty']:
+            continue
+        categories = _category_registry.get(col)
+        if categories is None:
+            _category_registry[col] = values.sort_values()
+        elif not values.isin(categories).all():
+            _category_registry[col] = categories.union(values)
+        registered.append(col)
+    return registered
+
+
+def compact_categories(df_in:pd.DataFrame,cols:list = None,
+                       register:bool = True) -> pd.DataFrame:
+    """
+    Stores low cardinality text columns as categoricals. Categories are
+    shared through _category_registry, growing as new values are seen, so
+    frames compacted separately can be concatenated and joined on codes once
+    they are brought up to the registry categories (see concat_frames).
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        dataframe.
+    cols : list, optional
+        columns to compact. The default is category_cols.
+    register : bool, optional
+        add the column values to the registry first. The default is True.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        df_in with the columns as categoricals over the registry categories.
+    """
+    if cols is None:
+        cols = category_cols
+    if register:
+        cols = register_categories(df_in,cols)
+    df_out = df_in.copy(deep=False)
+    for col in df_out.columns.intersection(cols):
+        if col not in _category_registry or \
+                pd.api.types.infer_dtype(df_out[col],skipna=True) not in \
+                ['string','empty','categorical']:
+            continue
+        dtype = pd.CategoricalDtype(_category_registry[col])
+        if df_out[col].dtype != dtype:
+            df_out[col] = df_out[col].astype(dtype)
+    return df_out
+
+
+def concat_frames(df_list:list,**kwargs) -> pd.DataFrame:
+    """
+    pd.concat, keeping categorical columns categorical in compact_dtypes
+    mode by bringing every frame up to the same registry categories first.
+    Parameters
+    ----------
+    df_list : list
+        dataframes.
+    **kwargs
+        passed to pd.concat.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        the concatenated frames.
+    """
+    if compact_dtypes:
+        # register every frame's values before casting any frame, so all
+        # frames are cast to the same, final categories
+        df_list = list(df_list)
+        for df_in in df_list:
+            register_categories(df_in)
+        df_list = [compact_categories(df_in,register=False)
+                   for df_in in df_list]
+    return pd.concat(df_list,**kwargs)
+
+
+def process_pool(workers:int,initializer=None,
+                 initargs:tuple = ()) -> ProcessPoolExecutor:
+    """
+    Process pool for parallel work. Workers are forked where possible so
+    they inherit the settings of the running script. Elsewhere (Windows)
+    they are spawned and import the script, which only runs the pipeline
+    under __main__, so they see the settings as saved in the file.
+    Parameters
+    ----------
+    workers : int
+        number of worker processes.
+    initializer : callable, optional
+        called with initargs once in each worker as it starts. Forked
+        workers get initargs without pickling. The default is None.
+    initargs : tuple, optional
+        initializer arguments. The default is ().
+    Returns
+    -------
+    pool : ProcessPoolExecutor
+        the pool, or None for one worker.
+    """
+    if workers <= 1:
+        return None
+    start_method = 'fork' if 'fork' in \
+        multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(start_method),
+        initializer=initializer,initargs=initargs)
+
+
+def ingest_pool(workers:int) -> ProcessPoolExecutor:
+    """
+    Pool reading M files, started once for the run and reused by every
+    worksheet rather than started and shut down per worksheet
+    Parameters
+    ----------
+    workers : int
+        number of worker processes.
+    Returns
+    -------
+    pool : ProcessPoolExecutor
+        the pool, or None for one worker.
+    """
+    if workers <= 1:
+        return None
+    if workers not in _ingest_pools:
+        _ingest_pools[workers] = process_pool(workers)
+    return _ingest_pools[workers]
+
+
+def close_ingest_pools():
+    """
+    Shuts down the pools started by ingest_pool, so the next run starts
+    workers with its own settings
+    """
+    for pool in _ingest_pools.values():
+        pool.shutdown()
+    _ingest_pools.clear()
+
+
+def load_mult_wbooks(files_list:list,sheet_name:str,
+                     workers:int = None,columns:list = None,
+                     numeric:list = None) -> pd.DataFrame:
+    """
+    Loads and appends multiple worksheets to a dataframe.
+    Parameters
+    ----------
+    files_list : list
+        The list of M file references.
+    sheet_name : str
+        The target sheet name
+    workers : int, optional
+        processes used to read the workbooks in parallel. The default is
+        ingest_workers, or one when every workbook is in the workbook
+        cache.
+    columns : list, optional
+        columns to read, as for read_sheet. The default is None.
+    numeric : list, optional
+        columns read as numbers, as for read_sheet. The default is None.
+    Returns
+    -------
+    df_out : DataFrame
+        The appended worksheets in a dataframe, in files_list order.
+    """
+    if isinstance(files_list,str):
+        files_list = [files_list]
+    files_list_out = [file_spec + ' ' + extract_date+".xlsx" 
+                      for file_spec in files_list]
+    if workers is None:
+        # cached reads are cheaper than sending the frames back from workers
+        workers = 1 if all(workbook_cached(fname)
+                           for fname in files_list_out) else ingest_workers
+    pool = ingest_pool(min(workers,len(files_list_out)))
+    if pool is None:
+        df_list = [read_sheet(sheet_name,fname,2,columns,numeric)
+                   for fname in files_list_out]
+    else:
+        results = list(pool.map(profiled_call,
+                                itertools.repeat('read_sheet'),
+                                itertools.repeat(sheet_name),
+                                files_list_out,
+                                itertools.repeat(2),
+                                itertools.repeat(columns),
+                                itertools.repeat(numeric)))
+        df_list = []
+        for df_out, records in results:
+            df_list.append(df_out)
+            _profile_records.extend(records)
+    if len(df_list) == 0:
+        return pd.DataFrame()
+    df_out = concat_frames(df_list)
+    return df_out
+
+
+class ReportAccumulator:
+    """
+    Collects the output of each extract and concatenates them once, rather
+    than re-copying everything collected so far on every worksheet family.
+    Parameters
+    ----------
+    sink : callable, optional
+        called with each frame as it is added, eg to write it out. Frames
+        passed to a sink are not kept in memory. The default is None.
+    """
+
+    def __init__(self,sink=None):
+        self.frames = []
+        self.sink = sink
+        self.rows = 0
+
+    def add(self,df_in:pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds one extract output.
+        Parameters
+        ----------
+        df_in : pd.DataFrame
+            extract output.
+        Returns
+        -------
+        df_in : pd.DataFrame
+            the frame added.
+        """
+        self.rows += df_in.shape[0]
+        if self.sink is None:
+            self.frames.append(df_in)
+        else:
+            self.sink(df_in)
+        return df_in
+
+    def extend(self,df_list:list):
+        """
+        Adds extract outputs in order.
+        Parameters
+        ----------
+        df_list : list
+            list of extract outputs.
+        """
+        for df_in in df_list:
+            self.add(df_in)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Concatenates the collected frames.
+        Returns
+        -------
+        df_out : pd.DataFrame
+            all extract outputs in the order added.
+        """
+        if len(self.frames) == 0:
+            return pd.DataFrame()
+        return concat_frames(self.frames)
+
+
+class FrameShards:
+    """
+    An output of an out of core run: a dataframe kept on disk as pickled
+    shards, each holding the rows of a set of projects, read back a shard
+    at a time by iterating.
+    Parameters
+    ----------
+    paths : list
+        shard files, in shard order.
+    """
+
+    def __init__(self,paths:list):
+        self.paths = list(paths)
+
+    def __iter__(self):
+        for path in self.paths:
+            yield pd.read_pickle(path)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Concatenates the shards, for outputs that fit in memory.
+        Returns
+        -------
+        df_out : pd.DataFrame
+            rows of every shard, in shard order.
+        """
+        return concat_frames(list(self),ignore_index=True)
+
+
+def get_indicator(df_in:pd.DataFrame,
+                  indicator:str,
+                  value:str) -> pd.DataFrame:
+    """
+    Extract indicator column data
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        Project and indicator source dataframe.
+    indicator : str
+        New indicator column name.
+    value : str
+        Test value found source dataframe.
+    Returns
+    -------
+   df_out : pd.DataFrame
+        A 2 column list to be joined to the output list.
+    """
+    df_out = df_in.copy(deep=True)    
+    df_out[indicator]='Y'
+    return  df_out[df_out['short_term_outcome_indicator_outcome']==
+                value][['merit_project_id',indicator]]
+
+
+def ids_by_df(ids_in:pd.DataFrame, df_in:pd.DataFrame, fy,
+              lazy:bool = False) -> pd.DataFrame:
+    """
+    Create bulk project services
+    Parameters
+    ----------
+    ids_in : pd.DataFrame
+        Project Ids.
+    df_in : pd.DataFrame
+        project Service descriptions.
+    fy : str or list
+        financial year text, or a list of financial years.
+    lazy : bool, optional
+        return a ServiceGrid that is only expanded when it is joined. The
+        default is False.
+    Returns
+    -------
+    df_out : DataFrame
+        A dataframe with an project id for each project service, for each
+        financial year in turn.
+    """
+    if isinstance(fy,str):
+        fy = [fy]
+    if lazy:
+        return ServiceGrid(ids_in,df_in,fy)
+    ids = ids_in.sort_values().values
+    n_services = df_in.shape[0]
+    n_rows = ids.shape[0] * n_services
+    df_out = pd.DataFrame({
+        'merit_project_id':np.tile(np.repeat(ids,n_services),len(fy)),
+        'service':np.tile(df_in.service.values,ids.shape[0] * len(fy)),
+        'target_measure':np.tile(df_in.target_measure.values,
+                                 ids.shape[0] * len(fy)),
+        'total_to_be_delivered':total_to_be_delivered_missing,
+        'report_financial_year':np.repeat(np.array(fy,dtype=object),n_rows),
+        'fy_target':fy_target_missing})
+    return df_out
+
+
+class ServiceGrid:
+    """
+    The project id x service x financial year grid of ids_by_df, kept as its
+    three parts until it is joined.
+    Parameters
+    ----------
+    ids_in : pd.DataFrame
+        Project Ids.
+    df_in : pd.DataFrame
+        project Service descriptions.
+    fy : list
+        financial years.
+    """
+
+    def __init__(self,ids_in:pd.DataFrame,df_in:pd.DataFrame,fy:list):
+        self.ids_in = ids_in
+        self.df_in = df_in
+        self.fy = fy
+        self.ids = pd.DataFrame({'merit_project_id':ids_in.values})
+        self.services = df_in[['service','target_measure']]
+        self.fys = pd.DataFrame({'report_financial_year':fy})
+
+    def __len__(self):
+        return self.ids.shape[0] * self.services.shape[0] * len(self.fy)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Builds the whole grid, as ids_by_df.
+        Returns
+        -------
+        df_out : pd.DataFrame
+            project services grid.
+        """
+        return ids_by_df(self.ids_in,self.df_in,self.fy)
+
+    def join(self,df_in:pd.DataFrame) -> pd.DataFrame:
+        """
+        Inner join to the grid on merit_project_id, service, target_measure
+        and report_financial_year, without building the grid.
+        Parameters
+        ----------
+        df_in : pd.DataFrame
+            report rows.
+        Returns
+        -------
+        df_out : pd.DataFrame
+            the matching report rows with total_to_be_delivered and
+            fy_target.
+        """
+        df_out = df_in.merge(self.ids,on='merit_project_id',how='inner').\
+            merge(self.services,on=['service','target_measure'],
+                  how='inner').\
+            merge(self.fys,on='report_financial_year',how='inner')
+        df_out['total_to_be_delivered'] = total_to_be_delivered_missing
+        df_out['fy_target'] = fy_target_missing
+        return df_out
+
+
+class ServiceTable:
+    """
+    The project_services stage output in lazy_service_grid mode: the SGE
+    grid, unexpanded, and the RLP project services. Iterating yields the
+    rows of the eager output in its order, the grid a financial year at a
+    time then the RLP rows, so exports only expand the grid as they write
+    it.
+    Parameters
+    ----------
+    grid : ServiceGrid
+        SGE project services grid.
+    df_in : pd.DataFrame
+        RLP project services.
+    """
+
+    def __init__(self,grid:ServiceGrid,df_in:pd.DataFrame):
+        self.grid = grid
+        self.df = df_in
+
+    def __len__(self):
+        return len(self.grid) + self.df.shape[0]
+
+    def __iter__(self):
+        for fy in self.grid.fy:
+            yield ids_by_df(self.grid.ids_in,self.grid.df_in,[fy])
+        yield self.df
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Builds the whole output, as the eager project_services stage.
+        Returns
+        -------
+        df_out : pd.DataFrame
+            project services.
+        """
+        return concat_frames([self.grid.to_frame(),self.df])
+
+
+@profiled(lambda args: {'detail':joined_labels(np.ravel([args['cols']]))})
+def split_col_to_rows(df_in:pd.DataFrame,
+                      cols:list,
+                      sep:str = None) -> pd.DataFrame:
+    """
+    Splits delimited text columns into a row per value. Values are split,
+    stripped and de-duplicated within each row with vectorized string
+    operations. Several columns are split side by side, the n-th value of
+    each column on the n-th row of its parent row.
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        data.
+    cols : list
+        column name, or names, to split.
+    sep : str, optional
+        regular expression matching the delimiters. The default is None,
+        species_split_pattern.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        a row per value, with the other columns and the index of the parent
+        row in df_in. Rows with no values are left out.
+    """
+    if sep is None:
+        sep = species_split_pattern
+    cols = [cols] if isinstance(cols,str) else list(cols)
+    parts = []
+    for col in cols:
+        values = df_in[col].reset_index(drop=True).dropna().astype(str).\
+            str.split(sep,regex=True).explode().str.strip()
+        values = values[values.str.len() > 0]
+        values = values[~pd.DataFrame({'row':values.index,
+                                       'value':values.to_numpy()}).\
+                        duplicated().to_numpy()]
+        values.index = pd.MultiIndex.from_arrays(
+            [values.index,values.groupby(level=0).cumcount().to_numpy()])
+        parts.append(values.rename(col))
+    df_split = pd.concat(parts,axis=1).sort_index()
+    df_out = df_in.iloc[df_split.index.get_level_values(0).to_numpy()].copy()
+    for col in cols:
+        df_out[col] = df_split[col].to_numpy()
+    return df_out
+
+
+@profiled(lambda args: {
+    'detail':joined_labels(np.ravel([args['agg_col']]))})
+def conc_col(df_in:pd.DataFrame,
+             group_cols:list,
+             agg_col:list,
+             sep:str = '|') -> pd.DataFrame:
+    """
+    conc_col
+    
+    joins the distinct non null values of each aggregation column per group,
+    values in ascending order and groups sorted by the group columns.
+    Group keys and values are factorized and sorted once as integer codes and
+    the strings are joined over the group offsets, with pyarrow when it is
+    installed. Several aggregation columns are combined with an outer join on
+    the group columns. df_in is not copied.
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        rows with the group and aggregation columns.
+    group_cols : list
+        group column name or names.
+    agg_col : list
+        aggregation column name or names, string values.
+    sep : str, optional
+        separator. The default is '|'.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        group columns and one joined column per aggregation column.
+    """
+    group_cols = [group_cols] if isinstance(group_cols,str) else \
+        list(group_cols)
+    agg_cols = [agg_col] if isinstance(agg_col,str) else list(agg_col)
+    if backend == 'polars':
+        return polars_conc_col(df_in,group_cols,agg_cols,sep)
+    codes = np.zeros(df_in.shape[0],dtype=np.int64)
+    valid = np.ones(df_in.shape[0],dtype=bool)
+    n_codes = 1.0
+    for col in group_cols:
+        col_codes, col_values = pd.factorize(df_in[col],sort=True)
+        n_codes *= max(len(col_values),1)
+        valid &= col_codes >= 0
+        codes = codes * max(len(col_values),1) + col_codes
+    if n_codes >= 2.0**62:
+        raise ValueError('Too many distinct groups to combine into one code')
+    joined = {}
+    for col in agg_cols:
+        mask = valid & df_in[col].notna().to_numpy()
+        value_codes, values = pd.factorize(df_in[col].to_numpy()[mask],
+                                           sort=True)
+        n_values = max(len(values),1)
+        group_ids, group_inverse = np.unique(codes[mask],return_inverse=True)
+        pairs = np.unique(group_inverse.astype(np.int64) * n_values +
+                          value_codes)
+        offsets = np.searchsorted(pairs // n_values,
+                                  np.arange(len(group_ids)+1))
+        joined[col] = pd.Series(
+            conc_values(values[pairs % n_values],offsets,sep),
+            index=group_ids)
+    group_codes = np.unique(np.concatenate(
+        [series.index.to_numpy() for series in joined.values()]))
+    row_codes, first_rows = np.unique(codes[valid],return_index=True)
+    first_rows = np.flatnonzero(valid)[first_rows[
+        np.searchsorted(row_codes,group_codes)]]
+    df_out = df_in[group_cols].iloc[first_rows].reset_index(drop=True)
+    for col in agg_cols:
+        df_out[col] = joined[col].reindex(group_codes).to_numpy()
+    return df_out
+
+
+def conc_values(values:np.ndarray,offsets:np.ndarray,sep:str) -> np.ndarray:
+    """
+    Joins values[offsets[i]:offsets[i+1]] for each i
+    Parameters
+    ----------
+    values : np.ndarray
+        strings in group order.
+    offsets : np.ndarray
+        group start positions followed by len(values).
+    sep : str
+        separator.
+    Returns
+    -------
+    joined : np.ndarray
+        one joined string per group.
+    """
+    if pa is not None:
+        lists = pa.ListArray.from_arrays(pa.array(offsets,type=pa.int32()),
+                                         pa.array(values,type=pa.string()))
+        return pc.binary_join(lists,sep).to_numpy(zero_copy_only=False)
+    return np.array([sep.join(values[start:end]) for start, end in
+                     zip(offsets[:-1],offsets[1:])],dtype=object)
+
+
+def sorted_unique(values:pd.Series) -> list:
+    """
+    Distinct non null values in ascending order
+    """
+    return sorted(values.dropna().unique())
+
+
+def outcomes_summary(df_in:pd.DataFrame,
+                     value_cols:dict=None,
+                     types:list=None) -> pd.DataFrame:
+    """
+    Pipe joined outcome columns per project from one grouping of RLP Outcomes
+    by merit_project_id and type_of_outcomes. The combined primary and
+    secondary columns are unions of the per type values, so the result
+    matches conc_col run on each filtered copy.
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        RLP Outcomes.
+    value_cols : dict, optional
+        value column to (combined, per type...) output column names. The
+        default is outcome_summary_cols.
+    types : list, optional
+        type_of_outcomes values in the order of the per type output
+        columns. The default is outcome_types.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        merit_project_id and one column per output name.
+    """
+    if value_cols is None:
+        value_cols = outcome_summary_cols
+    if types is None:
+        types = outcome_types
+    group_cols = ['merit_project_id','type_of_outcomes']
+    df_temp = df_in.loc[df_in['type_of_outcomes'].isin(types),
+                        group_cols + list(value_cols)]
+    by_type = df_temp.groupby(group_cols).agg(sorted_unique)
+    out_cols = {}
+    for value_col, (combined_col, *type_cols) in value_cols.items():
+        lists = by_type[value_col]
+        out_cols[combined_col] = lists.groupby(level=0).agg(
+            lambda s: sorted(set(itertools.chain.from_iterable(s))))
+        for type_name, type_col in zip(types, type_cols):
+            # a type no project has gives an empty column, not a KeyError
+            out_cols[type_col] = lists[lists.index.get_level_values(1) ==
+                                       type_name].droplevel(1)
+    df_out = pd.DataFrame(out_cols)
+    df_out = df_out.apply(lambda col: col.map(
+        lambda v: '|'.join(v) if isinstance(v, list) and v else np.nan))
+    df_out = df_out.dropna(how='all')
+    df_out.index.name = 'merit_project_id'
+    return df_out.reset_index()
+
+
+class ServiceIndex:
+    """
+    project_services indexed once on its join keys. Each key column is coded
+    against its distinct values, the codes are combined into one integer key
+    and the keys are sorted, so a join is a binary search per report row
+    rather than a new hash table over project_services.
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        project services.
+    keys : list, optional
+        join key columns. The default is service_keys.
+    """
+
+    def __init__(self,df_in:pd.DataFrame,keys:list = None):
+        self.keys = service_keys if keys is None else keys
+        df_in = df_in.reset_index(drop=True)
+        self.key_values = [pd.Index(pd.unique(df_in[key].dropna()))
+                           for key in self.keys]
+        if np.prod([float(len(values)) for values in self.key_values]) \
+                >= 2.0**62:
+            raise ValueError('Too many distinct keys to combine into one code')
+        codes = self.key_codes(df_in)
+        self.order = np.argsort(codes,kind='stable')
+        self.sorted_codes = codes[self.order]
+        self.df_values = df_in.drop(columns=self.keys)
+
+    def key_codes(self,df_in:pd.DataFrame) -> np.ndarray:
+        """
+        Combined integer key for each row.
+        Parameters
+        ----------
+        df_in : pd.DataFrame
+            rows with the key columns.
+        Returns
+        -------
+        codes : np.ndarray
+            int64 key, -1 where a key value is missing or not indexed.
+        """
+        codes = np.zeros(df_in.shape[0],dtype=np.int64)
+        missing = np.zeros(df_in.shape[0],dtype=bool)
+        for key,values in zip(self.keys,self.key_values):
+            key_codes = values.get_indexer(df_in[key])
+            missing |= key_codes < 0
+            codes = codes * len(values) + key_codes
+        codes[missing] = -1
+        return codes
+
+    def join(self,df_in:pd.DataFrame) -> pd.DataFrame:
+        """
+        Inner join to the indexed project services, as pd.merge on the keys.
+        Rows keep the order of df_in.
+        Parameters
+        ----------
+        df_in : pd.DataFrame
+            report rows.
+        Returns
+        -------
+        df_out : pd.DataFrame
+            df_in rows with the project services columns, one row per match.
+        """
+        codes = self.key_codes(df_in)
+        first = np.searchsorted(self.sorted_codes,codes,side='left')
+        last = np.searchsorted(self.sorted_codes,codes,side='right')
+        counts = np.where(codes < 0,0,last - first)
+        left_pos = np.repeat(np.arange(df_in.shape[0]),counts)
+        match_no = np.arange(left_pos.shape[0]) - \
+            np.repeat(np.cumsum(counts) - counts,counts)
+        right_pos = self.order[np.repeat(first,counts) + match_no]
+        df_out = df_in.iloc[left_pos].reset_index(drop=True)
+        for col in self.df_values.columns:
+            df_out[col] = self.df_values[col].values[right_pos]
+        return df_out
+
+
+class ProjectServices:
+    """
+    The project services report rows are joined to: the project services,
+    indexed once when index_project_services is on, and the unexpanded SGE
+    grid in lazy_service_grid mode.
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        project services.
+    grid : ServiceGrid, optional
+        SGE project services grid, joined as well. The default is None.
+    """
+
+    def __init__(self,df_in:pd.DataFrame,grid:ServiceGrid = None):
+        self.df = df_in
+        self.grid = grid
+        self.index = ServiceIndex(df_in) if index_project_services else None
+        self.polars_frames = None
+
+    def join(self,df_in:pd.DataFrame) -> pd.DataFrame:
+        """
+        Inner join of report rows to the project services on service_keys
+        Parameters
+        ----------
+        df_in : pd.DataFrame
+            report rows.
+        Returns
+        -------
+        df_out : pd.DataFrame
+            df_in rows with the project services columns.
+        """
+        if backend == 'polars':
+            return pandas_frame(self.polars_join(polars_frame(df_in)),df_in)
+        if self.grid is not None:
+            # in the eager order: each report row's grid matches, as the
+            # grid comes first in project_services, then its other matches
+            df_in = df_in.assign(**{report_row_col:np.arange(df_in.shape[0])})
+        if self.index is None:
+            df_out = pd.merge(df_in,self.df,on=service_keys,how='inner')
+        else:
+            df_out = self.index.join(df_in)
+        if self.grid is not None:
+            df_out = concat_frames([self.grid.join(df_in),df_out],
+                                   ignore_index=True).\
+                sort_values(report_row_col,kind='stable').\
+                drop(columns=report_row_col).reset_index(drop=True)
+        return df_out
+
+    def polars_join(self,lf_in):
+        """
+        The join as a step of a Polars lazy query, as the pandas join.
+        Parameters
+        ----------
+        lf_in : pl.LazyFrame
+            report rows.
+        Returns
+        -------
+        lf_out : pl.LazyFrame
+            report rows with the project services columns.
+        """
+        if self.polars_frames is None:
+            self.polars_frames = [polars_frame(self.df)]
+            if self.grid is not None:
+                self.polars_frames += [
+                    polars_frame(self.grid.ids),
+                    polars_frame(self.grid.services),
+                    polars_frame(self.grid.fys)]
+        if self.grid is not None:
+            lf_in = lf_in.with_row_index(report_row_col)
+        lf_out = lf_in.join(self.polars_frames[0],on=service_keys,
+                            how='inner',maintain_order='left_right')
+        if self.grid is not None:
+            ids, services, fys = self.polars_frames[1:]
+            lf_grid = lf_in.join(ids,on='merit_project_id',how='inner',
+                                 maintain_order='left_right').\
+                join(services,on=['service','target_measure'],how='inner',
+                     maintain_order='left_right').\
+                join(fys,on='report_financial_year',how='inner',
+                     maintain_order='left_right').\
+                with_columns(
+                    total_to_be_delivered=pl.lit(
+                        total_to_be_delivered_missing),
+                    fy_target=pl.lit(fy_target_missing))
+            lf_out = pl.concat([lf_grid,lf_out],how='vertical_relaxed').\
+                sort(report_row_col,maintain_order=True).\
+                drop(report_row_col)
+        return lf_out
+
+
+@profiled(lambda args: {
+    'service':joined_labels(args['df_in'][args['service']]),
+    'target_measure':joined_labels(args['df_in'][args['target_measure']])})
+def join_by_service_target_measure(df_in:pd.DataFrame,service:str,
+                                    target_measure:str,
+                                    grant_or_procurement:str='procurement',
+                                    services:ProjectServices=None
+                                    ) -> pd.DataFrame:
+    """
+    Join by service and target measure
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        input dataframe.
+    service : str
+        service name.
+    target_measure : str
+        target measure name.
+    grant_or_procurement : str, optional
+        either grant or procurement. The default is 'procurement'.
+    services : ProjectServices
+        project services to join to.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        output dataframe.
+    """
+    if services is None:
+        raise ValueError('No project services to join to')
+    df_out = services.join(df_in)
+    df_out['grant_or_procurement'] = grant_or_procurement
+    return df_out  
+
+def project_attributes(df_list:list) -> pd.DataFrame:
+    """
+    Assembles per project attribute frames into one frame, aligned on
+    merit_project_id rather than merged one after another.
+    Parameters
+    ----------
+    df_list : list
+        dataframes with merit_project_id and attribute columns, at most one
+        row per project once duplicate rows are dropped.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        all attribute columns indexed by merit_project_id.
+    """
+    aligned = []
+    for df_in in df_list:
+        df_temp = df_in.drop_duplicates().set_index('merit_project_id')
+        if not df_temp.index.is_unique:
+            raise ValueError('More than one row per project for ' +
+                             ', '.join(map(str,df_temp.columns)))
+        aligned.append(df_temp)
+    df_out = pd.concat(aligned,axis=1)
+    df_out.index.name = 'merit_project_id'
+    return df_out
+
+
+def join_project_attributes(df_in:pd.DataFrame,
+                            attributes:pd.DataFrame) -> pd.DataFrame:
+    """
+    Left joins the project attributes to each row of df_in
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        rows with merit_project_id.
+    attributes : pd.DataFrame
+        project attributes from project_attributes.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        df_in with the attribute columns.
+    """
+    if backend == 'polars':
+        return polars_join_attributes(df_in,attributes)
+    df_out = df_in.merge(attributes,left_on='merit_project_id',
+                         right_index=True,how='left').reset_index(drop=True)
+    return df_out
+
+
+def polars_frame(df_in:pd.DataFrame):
+    """
+    Lazy Polars frame of a dataframe, categoricals as strings
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        data, with unique column names.
+    Returns
+    -------
+    lf_out : pl.LazyFrame
+        the data.
+    """
+    if pl is None:
+        raise ImportError('polars is needed for the polars backend')
+    return pl.from_pandas(df_in.reset_index(drop=True)).lazy().\
+        with_columns(pl.col(pl.Categorical).cast(pl.String))
+
+
+def pandas_frame(lf_in,like:pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Runs a lazy Polars query into a dataframe
+    Parameters
+    ----------
+    lf_in : pl.LazyFrame
+        query.
+    like : pd.DataFrame, optional
+        frame whose categorical columns the output columns of the same name
+        are made categorical like. The default is None.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        query result.
+    """
+    df_out = lf_in.collect().to_pandas()
+    if like is not None:
+        for col in df_out.columns.intersection(like.columns):
+            if isinstance(like[col].dtype,pd.CategoricalDtype):
+                df_out[col] = df_out[col].astype(like[col].dtype)
+    return df_out
+
+
+def polars_conc_col(df_in:pd.DataFrame,group_cols:list,agg_cols:list,
+                    sep:str = '|') -> pd.DataFrame:
+    """
+    conc_col as a Polars lazy query
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        rows with the group and aggregation columns.
+    group_cols : list
+        group column names.
+    agg_cols : list
+        aggregation column names, string values.
+    sep : str, optional
+        separator. The default is '|'.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        group columns and one joined column per aggregation column.
+    """
+    lf_in = polars_frame(df_in[list(dict.fromkeys(group_cols + agg_cols))]).\
+        drop_nulls(group_cols)
+    lf_out = None
+    for col in agg_cols:
+        lf_col = lf_in.select(group_cols + [col]).drop_nulls(col).\
+            with_columns(pl.col(col).cast(pl.String)).unique().\
+            group_by(group_cols).agg(pl.col(col).sort().str.join(sep))
+        lf_out = lf_col if lf_out is None else \
+            lf_out.join(lf_col,on=group_cols,how='full',coalesce=True)
+    return pandas_frame(lf_out.sort(group_cols),df_in)
+
+
+def polars_extract_group(df_in:pd.DataFrame,specs:pd.DataFrame,
+                         measured:str,actual:str,invoiced:str,
+                         category:str,context:str,species:str,
+                         match_sub_category:bool,grant:bool,
+                         services:ProjectServices) -> pd.DataFrame:
+    """
+    The projection and the sub category and project services joins of
+    extract_group as one Polars lazy query, so only the columns used are
+    converted and no intermediate frame is copied.
+    Parameters
+    ----------
+    as extract_group.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        extract rows with an extract_spec_id column.
+    """
+    source_cols = [col for col in [measured,invoiced,actual,category,
+                                   context,species] if col is not None]
+    lf_in = polars_frame(df_in[list(dict.fromkeys(
+        project_cols_in + report_cols_in + source_cols))])
+    no_value = pl.lit(None,dtype=pl.Float64)
+    lf_out = lf_in.select(
+        [pl.col(col) for col in project_cols_in + report_cols_in] +
+        [(pl.lit(measured_missing) if measured is None else
+              pl.col(measured)).alias('measured'),
+         (no_value if invoiced is None else
+              pl.col(invoiced)).alias('invoiced'),
+         (pl.lit(actual_missing) if actual is None else
+              pl.col(actual)).alias('actual'),
+         (pl.lit('Various') if category is None else
+              pl.col(category)).alias('category'),
+         (no_value if context is None else
+              pl.col(context)).alias('context'),
+         (no_value if species is None else
+              pl.col(species)).alias('report_species')] +
+        ([] if species is None else [pl.col(species).alias('species')]))
+    spec_keys = specs[['extract_spec_id','service','target_measure']]
+    if match_sub_category:
+        lf_out = lf_out.join(
+            polars_frame(spec_keys.assign(
+                category=specs['sub_category'].values)),
+            on='category',how='inner',maintain_order='left_right')
+    else:
+        lf_out = lf_out.join(polars_frame(spec_keys),how='cross',
+                             maintain_order='left_right')
+    if grant:
+        lf_out = lf_out.with_columns(
+            service=pl.concat_str([
+                pl.col('activity_type'),
+                pl.lit(' > ' + specs['worksheet'].iloc[0])]),
+            total_to_be_delivered=pl.lit(total_to_be_delivered_missing),
+            fy_target=pl.lit(fy_target_missing),
+            grant_or_procurement=pl.lit('grant'))
+    else:
+        lf_out = services.polars_join(lf_out).with_columns(
+            grant_or_procurement=pl.lit('procurement'))
+    return pandas_frame(lf_out,df_in)
+
+
+def polars_join_attributes(df_in:pd.DataFrame,
+                           attributes:pd.DataFrame) -> pd.DataFrame:
+    """
+    join_project_attributes with the join done by Polars. The join matches
+    row numbers, as the attributes can have repeated column names.
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        rows with merit_project_id.
+    attributes : pd.DataFrame
+        project attributes from project_attributes.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        df_in with the attribute columns.
+    """
+    rows = pandas_frame(
+        polars_frame(df_in[['merit_project_id']]).with_row_index('left').
+        join(polars_frame(pd.DataFrame(
+                 {'merit_project_id':attributes.index.astype(object)})).
+             with_row_index('right'),
+             on='merit_project_id',how='left',maintain_order='left'))
+    df_out = df_in.iloc[rows['left'].to_numpy()].reset_index(drop=True)
+    right = rows['right'].fillna(-1).to_numpy().astype(np.int64)
+    df_attributes = attributes.reset_index(drop=True).reindex(right).\
+        reset_index(drop=True)
+    return pd.concat([df_out,df_attributes],axis=1)
+
+
+def check_backends(targets:list) -> dict:
+    """
+    Equivalence check of the polars backend against the pandas reference:
+    runs the targets with each backend, the stage cache off, and compares
+    the outputs
+    Parameters
+    ----------
+    targets : list
+        stage names.
+    Returns
+    -------
+    differences : dict
+        target name to None where the outputs are equal, else a description
+        of the difference.
+    """
+    global backend, use_stage_cache
+    saved = backend, use_stage_cache
+    try:
+        use_stage_cache = False
+        backend = 'pandas'
+        reference = run_stages(targets)
+        backend = 'polars'
+        outputs = run_stages(targets)
+    finally:
+        backend, use_stage_cache = saved
+    differences = {}
+    for name in targets:
+        differences[name] = frames_difference(reference[name],outputs[name])
+    return differences
+
+
+def frames_difference(df_reference,df_in) -> str:
+    """
+    Difference of two outputs, ignoring dtypes and the kind of missing
+    value: of their columns or shape, else of their values, or if they only
+    differ in row order
+    Parameters
+    ----------
+    df_reference : pd.DataFrame
+        reference output, a ServiceTable, or a dict of them.
+    df_in : pd.DataFrame
+        output compared, a ServiceTable, or a dict of them.
+    Returns
+    -------
+    difference : str
+        None when equal.
+    """
+    if isinstance(df_reference,dict):
+        differences = {name:frames_difference(df_reference[name],df_in[name])
+                       for name in df_reference}
+        return '; '.join(name + ': ' + difference
+                         for name,difference in differences.items()
+                         if difference is not None) or None
+    if isinstance(df_reference,ServiceTable):
+        df_reference, df_in = df_reference.to_frame(), df_in.to_frame()
+
+    def normal(df_out):
+        df_out = df_out.reset_index(drop=True).astype(object)
+        return df_out.where(df_out.notna(),None)
+    if list(df_reference.columns) != list(df_in.columns):
+        return 'columns differ: {} not in output, {} not in reference'.\
+            format(list(df_reference.columns.difference(df_in.columns)),
+                   list(df_in.columns.difference(df_reference.columns)))
+    if df_reference.shape != df_in.shape:
+        return 'shapes differ: {} and {}'.format(df_reference.shape,
+                                                 df_in.shape)
+    try:
+        pd.testing.assert_frame_equal(normal(df_reference),normal(df_in),
+                                      check_dtype=False)
+        return None
+    except AssertionError as error:
+        try:
+            by = list(range(df_reference.shape[1]))
+            pd.testing.assert_frame_equal(
+                normal(df_reference).T.reset_index(drop=True).T.\
+                    astype(str).sort_values(by).reset_index(drop=True),
+                normal(df_in).T.reset_index(drop=True).T.astype(str).\
+                    sort_values(by).reset_index(drop=True))
+            return 'same rows in a different order'
+        except (AssertionError,ValueError,KeyError):
+            return str(error).splitlines()[0]
+
+
+def project_fingerprints(df_list:list) -> pd.Series:
+    """
+    One hash per project over all of its rows in each dataframe. Row hashes
+    are summed, so the fingerprint does not depend on row order.
+    Parameters
+    ----------
+    df_list : list
+        dataframes with merit_project_id.
+    Returns
+    -------
+    fingerprints : pd.Series
+        uint64 fingerprint indexed by merit_project_id.
+    """
+    hashes = []
+    for df_no, df_in in enumerate(df_list):
+        salt = int(hashlib.sha1(str(df_no).encode('utf-8')).hexdigest()[:16],
+                   16)
+        row_hashes = pd.util.hash_pandas_object(df_in,index=False).to_numpy()
+        hashes.append(pd.Series(row_hashes ^ np.uint64(salt),
+                                index=df_in['merit_project_id'].to_numpy()))
+    if len(hashes) == 0:
+        return pd.Series(dtype=np.uint64)
+    return pd.concat(hashes).groupby(level=0).sum()
+
+
+def state_name(prefix:str,*parts,code:list = None) -> str:
+    """
+    Name of an incremental state, changing with its parts, the code making
+    the output and the settings that shape it, so a state is only reused
+    for the same work.
+    Parameters
+    ----------
+    prefix : str
+        state name prefix.
+    *parts
+        dataframes (eg extract specs, lookups) and other values the output
+        depends on.
+    code : list, optional
+        functions making the output, hashed with code_fingerprint. The
+        default is None.
+    Returns
+    -------
+    name : str
+        prefix and a hash of the parts.
+    """
+    digest = hashlib.sha1(repr((version,compact_lineage,schema_reads,
+                                compact_dtypes)).encode('utf-8'))
+    for func in code or []:
+        digest.update(code_fingerprint(func).encode('utf-8'))
+    for part in parts:
+        if isinstance(part,pd.DataFrame):
+            digest.update(repr(list(part.columns)).encode('utf-8'))
+            digest.update(pd.util.hash_pandas_object(part).to_numpy().\
+                          tobytes())
+        else:
+            digest.update(repr(part).encode('utf-8'))
+    return prefix + '_' + digest.hexdigest()[:16]
+
+
+def incremental_update(name:str,inputs:dict,compute) -> pd.DataFrame:
+    """
+    Recomputes an output only for projects whose input rows changed since
+    the state saved under name in incremental_state_dir, keeping the saved
+    output rows of the other projects. Projects no longer in the inputs are
+    dropped. compute must work project by project (the rows of a project
+    only depend on that project's input rows). Row order follows the saved
+    rows, then the recomputed rows.
+    Parameters
+    ----------
+    name : str
+        state name, see state_name.
+    inputs : dict
+        input name to dataframe with merit_project_id.
+    compute : callable
+        called with inputs filtered to the changed projects, returns the
+        output dataframe with merit_project_id.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        the output for every project in the inputs.
+    """
+    fingerprints = project_fingerprints(list(inputs.values()))
+    state_file = os.path.join(incremental_state_dir,name + '.pkl')
+    if os.path.exists(state_file):
+        previous = pd.read_pickle(state_file)
+        previous_fingerprints = previous['fingerprints'].reindex(
+            fingerprints.index)
+        unchanged = fingerprints.index[
+            (previous_fingerprints == fingerprints).to_numpy()]
+        changed = fingerprints.index.difference(unchanged)
+        # an output with no rows may have no columns either
+        df_kept = previous['output']
+        if 'merit_project_id' in df_kept:
+            df_kept = df_kept[df_kept['merit_project_id'].isin(unchanged)]
+        if len(changed) == 0:
+            df_out = df_kept.reset_index(drop=True)
+        else:
+            df_new = compute({
+                input_name:df_in[df_in['merit_project_id'].isin(changed)]
+                for input_name,df_in in inputs.items()})
+            df_out = concat_frames([df_kept,df_new],ignore_index=True)
+    else:
+        df_out = compute(inputs)
+    os.makedirs(incremental_state_dir,exist_ok=True)
+    tmp_file = state_file + '.' + str(os.getpid()) + '.tmp'
+    pd.to_pickle({'extract_date':extract_date,'fingerprints':fingerprints,
+                  'output':df_out},tmp_file)
+    os.replace(tmp_file,state_file)
+    return df_out
+
+
+pipeline_stages = {}
+
+
+def pipeline_stage(name:str,inputs:list = None,files=None):
+    """
+    Registers a pipeline stage, a function called with the outputs of its
+    input stages as keyword arguments.
+    Parameters
+    ----------
+    name : str
+        stage name.
+    inputs : list, optional
+        names of the stages it reads. The default is None.
+    files : callable, optional
+        returns the source files it reads. The default is None.
+    Returns
+    -------
+    register : callable
+        decorator adding the function to pipeline_stages.
+    """
+    def register(func):
+        pipeline_stages[name] = (func,list(inputs or []),files)
+        return func
+    return register
+
+
+def code_fingerprint(func) -> str:
+    """
+    Hash of a function's source and of everything in this script it uses,
+    found through the global names in its code: other functions and classes
+    (followed in turn) and settings and constants (by value). Private state
+    (names starting with _) is left out.
+    Parameters
+    ----------
+    func : callable
+        function defined in this script.
+    Returns
+    -------
+    fingerprint : str
+        sha1 hex digest.
+    """
+    digest = hashlib.sha1()
+    seen = set()
+
+    def add_code(code):
+        for name in code.co_names:
+            add_name(name)
+        for const in code.co_consts:
+            if isinstance(const,types.CodeType):
+                add_code(const)
+
+    def add_name(name):
+        if name in seen or name.startswith('_') or name not in globals():
+            return
+        seen.add(name)
+        value = globals()[name]
+        if inspect.isfunction(value) or inspect.isclass(value):
+            if value.__module__ != __name__:
+                return
+            try:
+                digest.update(inspect.getsource(value).encode('utf-8'))
+            except (OSError,TypeError):
+                digest.update(name.encode('utf-8'))
+            if inspect.isfunction(value):
+                add_code(inspect.unwrap(value).__code__)
+            else:
+                for member in vars(value).values():
+                    if inspect.isfunction(member):
+                        add_code(member.__code__)
+        elif isinstance(value,(pd.DataFrame,pd.Series)):
+            digest.update(name.encode('utf-8'))
+            digest.update(pd.util.hash_pandas_object(value).to_numpy().\
+                          tobytes())
+        elif isinstance(value,(str,int,float,bool,type(None),list,tuple,
+                               dict)):
+            digest.update((name + '=' + repr(value)).encode('utf-8'))
+
+    add_name(func.__name__)
+    return digest.hexdigest()
+
+
+def stage_keys(targets:list) -> dict:
+    """
+    Cache key of each stage the targets need: a hash of the stage code, the
+    keys of its input stages and the size and modification time of its
+    source files. A change anywhere upstream changes every key below it.
+    Parameters
+    ----------
+    targets : list
+        stage names.
+    Returns
+    -------
+    keys : dict
+        stage name to key.
+    """
+    keys = {}
+
+    def add_key(name):
+        if name in keys:
+            return
+        func, inputs, files = pipeline_stages[name]
+        for input_name in inputs:
+            add_key(input_name)
+        digest = hashlib.sha1(name.encode('utf-8'))
+        digest.update(code_fingerprint(func).encode('utf-8'))
+        for input_name in inputs:
+            digest.update(keys[input_name].encode('utf-8'))
+        for fname in (files() if files is not None else []):
+            if os.path.exists(fname):
+                stat = os.stat(fname)
+                file_text = '|'.join([os.path.abspath(fname),
+                                      str(stat.st_size),
+                                      str(stat.st_mtime_ns)])
+            else:
+                file_text = fname + '|missing'
+            digest.update(file_text.encode('utf-8'))
+        keys[name] = digest.hexdigest()
+
+    for name in targets:
+        add_key(name)
+    return keys
+
+
+def run_stages(targets:list) -> dict:
+    """
+    Runs the stages the targets need. With use_stage_cache on, each stage
+    output is kept in stage_cache_dir under its key and a stage is only run
+    when no output is cached for its current key, so after a change only
+    the stages downstream of it are run again. Cached inputs are only loaded
+    when a stage using them has to run.
+    Parameters
+    ----------
+    targets : list
+        stage names.
+    Returns
+    -------
+    outputs : dict
+        target stage name to output.
+    """
+    keys = stage_keys(targets)
+    outputs = {}
+
+    def get_output(name):
+        if name in outputs:
+            return outputs[name]
+        func, inputs, files = pipeline_stages[name]
+        cache_file = os.path.join(stage_cache_dir,
+                                  name + '_' + keys[name] + '.pkl')
+        if use_stage_cache and os.path.exists(cache_file):
+            outputs[name] = pd.read_pickle(cache_file)
+        else:
+            outputs[name] = func(**{input_name:get_output(input_name)
+                                    for input_name in inputs})
+            if use_stage_cache:
+                os.makedirs(stage_cache_dir,exist_ok=True)
+                tmp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+                pd.to_pickle(outputs[name],tmp_file)
+                os.replace(tmp_file,cache_file)
+        return outputs[name]
+
+    return {name:get_output(name) for name in targets}
+
+
+def table_frames(table) -> list:
+    """
+    The frames of an output, a FrameShards, a ServiceTable or a dataframe
+    """
+    return [table] if isinstance(table,pd.DataFrame) else table
+
+
+def export_frames(table,name:str):
+    """
+    Yields the frames of an output as exported: for the lineage_tables of a
+    compact lineage run, with export_expand_lineage on, with
+    extract_spec_id expanded into the meta columns
+    Parameters
+    ----------
+    table : pd.DataFrame
+        output, a dataframe, FrameShards or ServiceTable.
+    name : str
+        table name.
+    Yields
+    ------
+    df_frame : pd.DataFrame
+        the next frame.
+    """
+    for df_frame in table_frames(table):
+        if export_expand_lineage and name in lineage_tables and \
+                'extract_spec_id' in df_frame:
+            df_frame = expand_lineage(df_frame,lineage_tables[name])
+        yield df_frame
+
+
+def frame_schema(df_in:pd.DataFrame,positions:list):
+    """
+    Arrow schema of the columns of a dataframe at positions, inferred a
+    column at a time. Columns with no values are typed null, so shards
+    where a column is empty unify with those where it is not.
+    """
+    return pa.schema([
+        pa.field(str(df_in.columns[position]),pa.null())
+        if df_in.iloc[:,position].isna().all() else
+        pa.Schema.from_pandas(parquet_safe(df_in.iloc[:,[position]]),
+                              preserve_index=False).field(0)
+        for position in positions])
+
+
+def shard_numbers(ids:pd.Series,n_shards:int) -> np.ndarray:
+    """
+    Shard of each merit_project_id, from a hash that is the same in every
+    run and process
+    Parameters
+    ----------
+    ids : pd.Series
+        merit_project_id values.
+    n_shards : int
+        number of shards.
+    Returns
+    -------
+    shards : np.ndarray
+        shard numbers.
+    """
+    return (pd.util.hash_pandas_object(ids.astype(object),index=False).\
+        to_numpy() % np.uint64(n_shards)).astype(np.int64)
+
+
+def run_out_of_core(targets:list) -> dict:
+    """
+    Runs the pipeline with report_raw and the sharded_stages after it out
+    of core. The stages before report_raw are run by run_stages. The report
+    rows of each worksheet family are spilled to shard_dir as they are
+    made, then hash partitioned by merit_project_id into as many shards as
+    memory_budget_mb needs (shard_memory_factor times their in memory
+    size). The sharded_stages are run a shard at a time, on the shard's
+    report rows and the M01 rows of the shard's projects, and each output
+    shard is written to shard_dir.
+    Parameters
+    ----------
+    targets : list
+        stage names.
+    Returns
+    -------
+    outputs : dict
+        target stage name to output, a FrameShards for report_raw and the
+        sharded_stages.
+    """
+    if incremental:
+        raise ValueError('Incremental mode cannot run out of core')
+    sharded = ['report_raw'] + sharded_stages
+    upstream = sorted(set(input_name for name in sharded
+                          for input_name in pipeline_stages[name][1]) -
+                      set(sharded))
+    outputs = run_stages(upstream + [name for name in targets
+                                     if name not in sharded + upstream])
+    shutil.rmtree(shard_dir,ignore_errors=True)
+    os.makedirs(os.path.join(shard_dir,'families'))
+    family_files = []
+    report_bytes = 0
+
+    def spill(df_family):
+        family_files.append(os.path.join(
+            shard_dir,'families','{:03d}.pkl'.format(len(family_files))))
+        df_family.to_pickle(family_files[-1])
+
+    report_acc = ReportAccumulator(sink=spill)
+    for df_family in report_families(
+            **{name:outputs[name]
+               for name in pipeline_stages['report_raw'][1]}):
+        report_bytes += df_family.memory_usage(deep=True).sum()
+        report_acc.add(df_family)
+    n_shards = max(1,math.ceil(report_bytes * shard_memory_factor /
+                               (memory_budget_mb * 2**20)))
+
+    # hash partition each family's rows into pieces of the shards
+    for name in sharded:
+        os.makedirs(os.path.join(shard_dir,name))
+    for family_no,family_file in enumerate(family_files):
+        df_family = pd.read_pickle(family_file)
+        shards = shard_numbers(df_family['merit_project_id'],n_shards) \
+            if 'merit_project_id' in df_family else \
+            np.zeros(df_family.shape[0],dtype=np.int64)
+        for shard in range(n_shards):
+            df_family[shards == shard].to_pickle(os.path.join(
+                shard_dir,'report_raw',
+                '{:04d}_{:03d}.pkl'.format(shard,family_no)))
+        os.remove(family_file)
+
+    m01_sheets = outputs['m01_sheets']
+    m01_shards = {sheet:shard_numbers(df_sheet['merit_project_id'],n_shards)
+                  for sheet,df_sheet in m01_sheets.items()}
+    shard_files = {name:[] for name in sharded}
+    for shard in range(n_shards):
+        piece_files = [os.path.join(shard_dir,'report_raw',
+                                    '{:04d}_{:03d}.pkl'.format(shard,
+                                                               family_no))
+                       for family_no in range(len(family_files))]
+        shard_outputs = dict(
+            outputs,
+            m01_sheets={sheet:df_sheet[m01_shards[sheet] == shard]
+                        for sheet,df_sheet in m01_sheets.items()},
+            report_raw=concat_frames([pd.read_pickle(piece_file)
+                                      for piece_file in piece_files]))
+        for piece_file in piece_files:
+            os.remove(piece_file)
+        for name in sharded_stages:
+            func, inputs, files = pipeline_stages[name]
+            shard_outputs[name] = func(**{input_name:shard_outputs[input_name]
+                                          for input_name in inputs})
+        for name in sharded:
+            shard_files[name].append(os.path.join(
+                shard_dir,name,'{:04d}.pkl'.format(shard)))
+            shard_outputs[name].to_pickle(shard_files[name][-1])
+    outputs.update({name:FrameShards(shard_files[name]) for name in sharded})
+    return {name:outputs[name] for name in targets}
+
+
+def frame_batches(frames,schema,chunk_rows:int,positions:list):
+    """
+    Converts dataframes to Arrow record batches a chunk of rows at a time,
+    so a whole frame is never held as Arrow as well
+    Parameters
+    ----------
+    frames : iterable
+        dataframes with the same columns.
+    schema : pa.Schema
+        schema of every batch.
+    chunk_rows : int
+        rows per batch.
+    positions : list
+        positions of the columns converted.
+    Yields
+    ------
+    batch : pa.RecordBatch
+        the next chunk of rows.
+    """
+    for df_in in frames:
+        for start in range(0,df_in.shape[0],chunk_rows):
+            chunk = parquet_safe(df_in.iloc[start:start+chunk_rows,
+                                            list(positions)])
+            # empty numeric columns convert to other types as objects
+            for col in chunk.columns[chunk.isna().all().to_numpy() &
+                                     (chunk.dtypes != object).to_numpy()]:
+                chunk[col] = chunk[col].astype(object)
+            yield pa.RecordBatch.from_pandas(chunk,schema=schema,
+                                             preserve_index=False)
+
+
+def export_parquet(df_in:pd.DataFrame,name:str,
+                   partition_cols:list = None) -> str:
+    """
+    Streams a dataframe to a hive partitioned Parquet dataset in
+    export_dir, dictionary encoded with row group statistics. Partitions
+    written again replace their earlier files; other partitions (eg other
+    extract dates) are kept. Of duplicated column names only the first
+    column is written. Shards are written in one pass to a schema unifying
+    theirs, read in a first pass.
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        data, or a FrameShards.
+    name : str
+        dataset name, the directory under export_dir.
+    partition_cols : list, optional
+        partition columns, those not in df_in or with no values being
+        skipped. The default is export_partition_cols.
+    Returns
+    -------
+    path : str
+        dataset directory.
+    """
+    if pa is None:
+        raise ImportError('pyarrow is needed for parquet export')
+    if partition_cols is None:
+        partition_cols = export_partition_cols
+    path = os.path.join(export_dir,name)
+    schemas = []
+    partitions = []
+    for df_frame in export_frames(df_in,name):
+        positions = np.flatnonzero(~df_frame.columns.duplicated())
+        schemas.append(frame_schema(df_frame,positions))
+        partitions.append(df_frame[[
+            col for col in partition_cols if col in df_frame]].\
+            drop_duplicates())
+    schema = pa.unify_schemas(schemas,promote_options='permissive')
+    partition_cols = [col for col in partition_cols
+                      if col in schema.names and not pa.types.is_null(
+                          schema.field(col).type)]
+    n_partitions = concat_frames(partitions)[partition_cols].\
+        drop_duplicates().shape[0] if partition_cols else 1
+    ds.write_dataset(
+        frame_batches(export_frames(df_in,name),schema,export_chunk_rows,
+                      positions),path,
+        schema=schema,
+        format='parquet',
+        partitioning=partition_cols or None,partitioning_flavor='hive',
+        file_options=ds.ParquetFileFormat().make_write_options(
+            use_dictionary=True,write_statistics=True),
+        max_rows_per_group=export_row_group_rows,
+        max_partitions=max(n_partitions,1024),
+        existing_data_behavior='delete_matching')
+    return path
+
+
+def export_outputs(outputs:dict) -> dict:
+    """
+    Exports the export_tables among the outputs, and the extract metadata,
+    to Parquet
+    Parameters
+    ----------
+    outputs : dict
+        stage name to output, a dataframe or FrameShards.
+    Returns
+    -------
+    paths : dict
+        table name to dataset directory.
+    """
+    paths = {name:export_parquet(outputs[name],name)
+             for name in export_tables if name in outputs}
+    paths['metadata'] = export_parquet(extract_metadata(),'metadata')
+    return paths
+
+
+def export_database(outputs:dict) -> str:
+    """
+    Loads the export_tables, the lookup tables and the extract metadata
+    into a SQLite database in export_dir and indexes the database_indexes
+    columns of each table. Rows are inserted export_chunk_rows at a time
+    with executemany. Of duplicated column names only the first column is
+    loaded. The database is built in a temporary file, without a journal,
+    and only replaces the one at path once complete.
+    Parameters
+    ----------
+    outputs : dict
+        stage name to output, a dataframe or FrameShards, with the
+        lookups stage output.
+    Returns
+    -------
+    path : str
+        database path.
+    """
+    os.makedirs(export_dir,exist_ok=True)
+    path = os.path.join(export_dir,'big_download ' + extract_date + '.db')
+    tables = {name:outputs[name] for name in export_tables if name in outputs}
+    tables.update(outputs.get('lookups',{}))
+    tables['metadata'] = extract_metadata()
+    tmp_file = path + '.' + str(os.getpid()) + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    try:
+        load_database(tmp_file,tables)
+        os.replace(tmp_file,path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return path
+
+
+def load_database(path:str,tables:dict):
+    """
+    Loads tables into a SQLite database, as export_database
+    Parameters
+    ----------
+    path : str
+        database path.
+    tables : dict
+        table name to a dataframe or FrameShards.
+    """
+    with contextlib.closing(sqlite3.connect(path)) as con:
+        con.execute('PRAGMA journal_mode = OFF')
+        con.execute('PRAGMA synchronous = OFF')
+        for name,table in tables.items():
+            columns = None
+            for df_frame in export_frames(table,name):
+                if columns is None:
+                    columns = df_frame.columns
+                    positions = np.flatnonzero(~columns.duplicated())
+                    df_frame.iloc[:0,positions].to_sql(
+                        name,con,if_exists='replace',index=False)
+                for chunk in frame_chunks(df_frame,export_chunk_rows):
+                    chunk.iloc[:,positions].to_sql(
+                        name,con,if_exists='append',index=False)
+            for index_cols in database_indexes:
+                if all(col in columns for col in index_cols):
+                    con.execute('CREATE INDEX "ix_{}_{}" ON "{}" ({})'.format(
+                        name,'_'.join(index_cols),name,
+                        ','.join('"' + col + '"' for col in index_cols)))
+        con.execute('ANALYZE')
+        con.commit()
+
+
+def extract_metadata() -> pd.DataFrame:
+    """
+    Metadata table of the exports, the meta columns of each extract spec
+    Returns
+    -------
+    df_out : pd.DataFrame
+        report_lineage with extract_spec_id and extract_date columns.
+    """
+    df_out = report_lineage.rename_axis('extract_spec_id').reset_index()
+    df_out['extract_date'] = extract_date
+    return df_out
+
+
+def frame_chunks(df_in:pd.DataFrame,chunk_rows:int):
+    """
+    Yields a dataframe a chunk of rows at a time
+    """
+    for start in range(0,df_in.shape[0],chunk_rows):
+        yield df_in.iloc[start:start+chunk_rows]
+
+
+def write_excel_sheet(workbook,sheet_name:str,chunks,
+                      header_format=None) -> list:
+    """
+    Writes frames to a worksheet row by row, continuing on sheets named
+    'sheet_name (2)', 'sheet_name (3)'... past excel_max_rows rows. Numbers
+    and dates are written as typed cells and missing values left blank.
+    Each sheet gets the column headings and a filter.
+    Parameters
+    ----------
+    workbook : xlsxwriter.Workbook
+        workbook, in constant memory mode so written rows are flushed.
+    sheet_name : str
+        worksheet name.
+    chunks : iterable
+        dataframes with the same columns, written in turn.
+    header_format : xlsxwriter.format.Format, optional
+        heading format. The default is None.
+    Returns
+    -------
+    sheet_names : list
+        the worksheets written.
+    """
+    sheet_names = []
+    worksheet = None
+    for chunk in chunks:
+        values = chunk.astype(object).where(chunk.notna(),None).to_numpy()
+        for row in values:
+            if worksheet is None or row_no == excel_max_rows:
+                if worksheet is not None:
+                    worksheet.autofilter(0,0,row_no - 1,len(headings) - 1)
+                sheet_names.append(sheet_name if not sheet_names else
+                                   '{} ({})'.format(sheet_name,
+                                                    len(sheet_names) + 1))
+                worksheet = workbook.add_worksheet(sheet_names[-1])
+                headings = [str(col) for col in chunk.columns]
+                worksheet.write_row(0,0,headings,header_format)
+                row_no = 1
+            worksheet.write_row(row_no,0,row)
+            row_no += 1
+    if worksheet is not None:
+        worksheet.autofilter(0,0,row_no - 1,len(headings) - 1)
+    return sheet_names
+
+
+def export_workbook(outputs:dict) -> str:
+    """
+    Writes the analytical dataset workbook, as the R saveWorkbook step, in
+    xlsxwriter constant memory mode: each row is flushed to disk once the
+    next one is started, and frames are converted a chunk at a time.
+    Parameters
+    ----------
+    outputs : dict
+        stage name to output, a dataframe or FrameShards.
+    Returns
+    -------
+    path : str
+        workbook path.
+    """
+    if xlsxwriter is None:
+        raise ImportError('xlsxwriter is needed for the Excel export')
+    os.makedirs(export_dir,exist_ok=True)
+    path = os.path.join(export_dir,'analytical dataset multi line ' +
+                        extract_date + '.xlsx')
+    tables = dict(outputs,metadata=extract_metadata())
+    with xlsxwriter.Workbook(path,{'constant_memory':True,
+                                   'default_date_format':'yyyy-mm-dd',
+                                   'strings_to_numbers':False,
+                                   'strings_to_formulas':False,
+                                   'strings_to_urls':False}) as workbook:
+        header_format = workbook.add_format(excel_header_style)
+        for sheet_name,name in excel_sheets.items():
+            if name in tables:
+                write_excel_sheet(workbook,sheet_name,
+                                  (chunk for df_frame in
+                                   export_frames(tables[name],name)
+                                   for chunk in frame_chunks(
+                                       df_frame,export_chunk_rows)),
+                                  header_format)
+    return path
+
+
+def make_ref_df(df_in:pd.DataFrame,id_col:str,lookup_col:str,
+                lookup_vals:list) -> pd.DataFrame:
+    """
+    Does not work
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        DESCRIPTION.
+    *args : list
+        DESCRIPTION.
+    Returns
+    -------
+    df_out : TYPE
+        DESCRIPTION.
+    """
+    df_out = df_in.copy(deep=True)
+    filtered = df_out.lookup_col.isin(lookup_vals)
+    df_out = df_out[filtered][[id_col,lookup_col]]
+    df_out.drop_duplicates(inplace=True)
+    df_out = df_out[~df_out[lookup_col].isnull()]
+    df_out = conc_col(df_out,id_col,lookup_col)
+    return df_out
+
+
+def make_extract_specs(spec_list:list) -> pd.DataFrame:
+    """
+    Builds the extract spec registry
+    Parameters
+    ----------
+    spec_list : list
+        one dict per extract, holding the arguments of the transform
+        function named in transform_func.
+    Returns
+    -------
+    specs : pd.DataFrame
+        one row per extract with extract_spec_cols, numbered by
+        extract_spec_id in list order.
+    """
+    specs = pd.DataFrame.from_records(spec_list,columns=extract_spec_cols)
+    unknown = set(specs['transform_func']) - set(extract_shapes)
+    if len(unknown) > 0:
+        raise ValueError('Unknown transform_func: ' + ', '.join(unknown))
+    specs = specs.astype(object).where(specs.notnull(),None)
+    specs.insert(0,'extract_spec_id',range(specs.shape[0]))
+    return specs
+
+
+def read_extract_specs(fname:str) -> tuple:
+    """
+    Reads the extract spec registry
+    Parameters
+    ----------
+    fname : str
+        csv file with one row per extract: the family number and space
+        separated M files of its worksheet, then extract_spec_cols.
+    Returns
+    -------
+    specs : pd.DataFrame
+        extract specs from make_extract_specs, in file order.
+    worksheet_files : dict
+        worksheet name to M file references.
+    worksheet_families : list
+        worksheet names of each family, in family number order.
+    """
+    df_in = pd.read_csv(fname,dtype=str,keep_default_na=False,
+                        na_values=[''])
+    specs = make_extract_specs(df_in[extract_spec_cols].to_dict('records'))
+    sheets = df_in.drop_duplicates('worksheet')
+    worksheet_files = dict(zip(sheets['worksheet'],
+                               sheets['files'].str.split()))
+    worksheet_families = [
+        list(family['worksheet']) for _,family in
+        sheets.groupby(sheets['family'].astype(int),sort=True)]
+    return specs, worksheet_files, worksheet_families
+
+
+def extract_meta(specs:pd.DataFrame) -> pd.DataFrame:
+    """
+    Metadata columns for each extract spec
+    Parameters
+    ----------
+    specs : pd.DataFrame
+        extract specs from make_extract_specs.
+    Returns
+    -------
+    df_out : pd.DataFrame
+        extract_meta_cols indexed by extract_spec_id.
+    """
+    shapes = [extract_shapes[func] for func in specs.transform_func]
+    uses_context = [shape[2] for shape in shapes]
+    uses_species = [shape[3] for shape in shapes]
+    # the R grant extracts set meta_col_category NA, even those reading a
+    # category column
+    joins_services = [shape[4] for shape in shapes]
+    df_out = pd.DataFrame({
+        'meta_source_sheetname':specs['worksheet'].values,
+        'meta_transform_func':specs['transform_func'].values,
+        'meta_col_measured':specs['measured'].values,
+        'meta_col_actual':specs['actual'].values,
+        'meta_col_invoiced':specs['invoiced'].values,
+        'meta_col_category':np.where(joins_services,specs['category'],
+                                     None),
+        'meta_col_context':np.where(uses_context,specs['context'],np.nan),
+        'meta_text_subcategory':specs['sub_category'].values,
+        'meta_col_report_species':np.where(uses_species,specs['species'],
+                                           np.nan),
+        'meta_line_item_object_class':specs['object_class'].values,
+        'meta_line_item_property':specs['property'].values,
+        'meta_line_item_value':specs['value'].values},
+        index=specs['extract_spec_id'].values)
+    return df_out[extract_meta_cols]
+
+
+@profiled(lambda args: {
+    label:joined_labels(args['specs'][label]) for label in
+    ['worksheet','service','target_measure','sub_category']})
+def extract_group(df_in:pd.DataFrame, specs:pd.DataFrame, measured:str,
+                  actual:str, invoiced:str, category:str=None,
+                  context:str=None, species:str=None,
+                  match_sub_category:bool=False, grant:bool=False,
+                  services:ProjectServices=None) -> pd.DataFrame:
+    """
+    Runs the extract specs of a worksheet that read the same columns in one
+    pass: one projection, one join to pick the sub categories and one join
+    to the project services. Grant extracts are not joined to the project
+    services: their service is the activity type and worksheet, and only
+    rows with a species are kept when they read one.
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        worksheet data.
+    specs : pd.DataFrame
+        extract specs reading these columns.
+    measured : str
+        measured column, None for measured_missing.
+    actual : str
+        actual column, None for actual_missing.
+    invoiced : str
+        invoiced column, None for no invoiced value.
+    category : str, optional
+        category column. The default is None, giving category 'Various' for
+        every spec.
+    context : str, optional
+        context column. The default is None.
+    species : str, optional
+        species column, read as both species and report_species. The
+        default is None.
+    match_sub_category : bool, optional
+        keep the rows whose category is the sub_category of a spec, rather
+        than every row for every spec. The default is False.
+    grant : bool, optional
+        grant extracts. The default is False.
+    services : ProjectServices
+        project services to join to.
     Returns
     -------
     df_out : pd.DataFrame
-        The contents of the worksheet in a dataframe.
+        extract rows with an extract_spec_id column.
     """
-    df_out = pd.read_excel(fname,sheet_name=sheet_name,
-                         header=start_row).\
-        clean_names().rename({'grant_id':'merit_project_id'},axis=1)
+    if grant and species is not None:
+        df_in = df_in[df_in[species].notnull()]
+    if backend == 'polars':
+        df_out = polars_extract_group(df_in,specs,measured,actual,invoiced,
+                                      category,context,species,
+                                      match_sub_category,grant,services)
+        if not compact_lineage:
+            df_out = df_out.join(extract_meta(specs),on='extract_spec_id')
+        return df_out
+    df_out = df_in[project_cols_in+report_cols_in].copy()
+    df_out['measured'] = measured_missing if measured is None else \
+        df_in[measured].values
+    df_out['invoiced'] = np.nan if invoiced is None else \
+        df_in[invoiced].values
+    df_out['actual'] = actual_missing if actual is None else \
+        df_in[actual].values
+    df_out['category'] = 'Various' if category is None else \
+        df_in[category].values
+    df_out['context'] = np.nan if context is None else df_in[context].values
+    df_out['report_species'] = np.nan if species is None else \
+        df_in[species].values
+    if species is not None:
+        df_out['species'] = df_in[species].values
+    spec_keys = specs[['extract_spec_id','service','target_measure']]
+    if match_sub_category:
+        spec_keys = spec_keys.assign(category=specs['sub_category'].values)
+        df_out = df_out.merge(spec_keys,on='category',how='inner')
+    else:
+        df_out = df_out.merge(spec_keys,how='cross')
+    if grant:
+        df_out['service'] = df_out['activity_type'].astype(object) + \
+            ' > ' + specs['worksheet'].iloc[0]
+        df_out['total_to_be_delivered'] = total_to_be_delivered_missing
+        df_out['fy_target'] = fy_target_missing
+        df_out['grant_or_procurement'] = 'grant'
+    else:
+        df_out = join_by_service_target_measure(
+            df_out,'service','target_measure',services=services)
+    if not compact_lineage:
+        df_out = df_out.join(extract_meta(specs),on='extract_spec_id')
     return df_out
 
 
-def load_mult_wbooks(files_list:list,sheet_name:str) -> pd.DataFrame:
+def extract_batch(frames:dict, specs:pd.DataFrame,
+                  services:ProjectServices=None) -> pd.DataFrame:
     """
-    Loads and appends multiple worksheets to a dataframe.
+    Runs every extract spec whose worksheet is in frames. Specs are grouped
+    by worksheet and by the columns they read, and each group is run in one
+    pass by extract_group.
     Parameters
     ----------
-    files_list : list
-        The list of M file references.
-    sheet_name : str
-        The target sheet name
+    frames : dict
+        worksheet name to worksheet data.
+    specs : pd.DataFrame
+        extract specs from make_extract_specs.
+    services : ProjectServices
+        project services to join to.
     Returns
     -------
-    df_out : DataFrame
-        The appended worksheets in a dataframe.
+    df_out : pd.DataFrame
+        extract rows in spec order, as if each spec was run in turn. In
+        compact lineage mode rows carry extract_spec_id in place of the meta
+        columns.
     """
-    files_list_out = [file_spec + ' ' + extract_date+".xlsx" 
-                      for file_spec in files_list]
-    df_out = pd.DataFrame()
-    for fname in files_list_out:
-        df_temp = read_sheet(sheet_name, fname)
-        df_out = pd.concat([df_out,df_temp])
+    specs = specs[specs['worksheet'].isin(list(frames))]
+    groups = {}
+    for spec in specs.itertuples(index=False):
+        uses_category,match_sub_category,uses_context,uses_species,\
+            joins_services = extract_shapes[spec.transform_func]
+        key = (spec.worksheet,spec.measured,spec.actual,spec.invoiced,
+               spec.category if uses_category else None,
+               spec.context if uses_context else None,
+               spec.species if uses_species else None,
+               match_sub_category,not joins_services)
+        groups.setdefault(key,[]).append(spec.extract_spec_id)
+    df_list = [
+        extract_group(frames[key[0]],
+                      specs[specs['extract_spec_id'].isin(spec_ids)],
+                      *key[1:],services=services)
+        for key,spec_ids in groups.items()]
+    if len(df_list) == 0:
+        return pd.DataFrame()
+    df_out = concat_frames(df_list,ignore_index=True).\
+        sort_values('extract_spec_id',kind='stable').reset_index(drop=True)
+    if not compact_lineage:
+        df_out = df_out.drop(columns='extract_spec_id')
     return df_out
 
 
-def get_indicator(df_in:pd.DataFrame,
-                  indicator:str,
-                  value:str) -> pd.DataFrame:
+def extract_single(transform_func:str, df_in:pd.DataFrame,
+                   services:ProjectServices=None, **spec) -> pd.DataFrame:
     """
-    Extract indicator column data
+    Runs one extract, as the transform functions below.
     Parameters
     ----------
+    transform_func : str
+        transform function name.
     df_in : pd.DataFrame
-        Project and indicator source dataframe.
-    indicator : str
-        New indicator column name.
-    value : str
-        Test value found source dataframe.
+        worksheet data.
+    services : ProjectServices
+        project services to join to.
+    **spec : str
+        the transform function arguments.
     Returns
     -------
-   df_out : pd.DataFrame
-        A 2 column list to be joined to the output list.
+    df_out : pd.DataFrame
+        extract rows.
     """
-    df_out = df_in.copy(deep=True)    
-    df_out[indicator]='Y'
-    return  df_out[df_out['short_term_outcome_indicator_outcome']==
-                value][['merit_project_id',indicator]]
+    specs = make_extract_specs([dict(spec,transform_func=transform_func)])
+    return extract_batch({spec['worksheet']:df_in},specs,services)
 
 
-def ids_by_df(ids_in:pd.DataFrame, df_in:pd.DataFrame, fy:str) -> pd.DataFrame:
+@profiled(lambda args: {'worksheet':'RLP Output Report Adjustment'})
+def extract_adjustments(df_in:pd.DataFrame,
+                        services:ProjectServices=None) -> pd.DataFrame:
     """
-    Create bulk project services
+    Report rows for the RLP Output Report Adjustment worksheet, the
+    reported measure as actual and the adjustment as invoiced.
     Parameters
     ----------
-    ids_in : pd.DataFrame
-        Project Ids.
     df_in : pd.DataFrame
-        project Service descriptions.
-    fy : str
-        financial year text.
+        adjustment worksheet data.
+    services : ProjectServices
+        project services to join to.
     Returns
     -------
-    df_out : DataFrame
-        A dataframe with an project id for each project service.
-    """
-    df_temp = pd.concat(list(itertools.repeat(df_in,ids_in.shape[0])))
-    ids_out = pd.concat(list(itertools.repeat(ids_in,df_in.shape[0]))).sort_values()
-    df_out = pd.DataFrame({'merit_project_id':ids_out.values,
-                           'service':df_temp.service.values,
-                           'target_measure':df_temp.target_measure.values,
-                           'total_to_be_delivered':total_to_be_delivered_missing,
-                           'report_financial_year':fy,
-                           'fy_target':fy_target_missing})
-    return df_out
+    df_out : pd.DataFrame
+        adjustment rows joined to the project services.
+    """
+    df_out = df_in[project_cols_in + report_cols_in + adjustment_cols]
+    df_out = df_out.rename(columns={
+        'project_service':'service','output_measure':'target_measure'})
+    df_out['measured'] = np.nan
+    df_out['actual'] = df_out['reported_measure_requiring_adjustment']
+    df_out['invoiced'] = df_out['adjustment']
+    df_out['report_species'] = np.nan
+    df_out['category'] = np.nan
+    df_out['context'] = np.nan
+    df_out['sub_category'] = np.nan
+    if compact_lineage:
+        df_out['extract_spec_id'] = adjustment_spec_id
+    else:
+        for meta_col in extract_meta_cols:
+            df_out[meta_col] = report_lineage.loc[adjustment_spec_id,meta_col]
+    df_out = df_out.drop(['reported_measure_requiring_adjustment',
+                          'adjustment'],axis=1)
+    return join_by_service_target_measure(df_out,'service','target_measure',
+                                          services=services)
+
+
+def lineage_cols(cols:list) -> list:
+    """
+    Output columns for the lineage mode
+    Parameters
+    ----------
+    cols : list
+        output columns including the meta columns.
+    Returns
+    -------
+    cols_out : list
+        cols, or in compact lineage mode cols without the meta columns and
+        with extract_spec_id.
+    """
+    if not compact_lineage:
+        return cols
+    return [col for col in cols if not col.startswith('meta_')] + \
+        ['extract_spec_id']
 
-def split_col_to_rows(df_in:pd.Dataframe,
-              column:str,
-              regex:str) -> pd.DataFrame:
-    df_in = df_in.copy(deep=True)
-    df_out[column] = \
-    re.split(regex,df_out[column])
-    return df_out.explode(column)
 
-def conc_col(df_in:pd.DataFrame,
-             group_cols:list,
-             agg_col:str) -> pd.DataFrame:
+def expand_lineage(df_in:pd.DataFrame,cols:list = None,
+                   lineage:pd.DataFrame = None) -> pd.DataFrame:
     """
-    conc_col
-    
-    copies dataframe, drops duplicate rows, drops null values, sorts values.
+    Expands extract_spec_id back into the meta columns, as export_frames
+    does for the exports of a compact lineage run.
     Parameters
     ----------
     df_in : pd.DataFrame
-        DESCRIPTION.
-    group_cols : list
-        DESCRIPTION.
-    agg_col : str
-        DESCRIPTION.
+        rows with extract_spec_id.
+    cols : list, optional
+        output columns, as selected from the uncompacted rows: columns of
+        a duplicated name are shared evenly between the times it is listed.
+        The default is None, keeping all columns.
+    lineage : pd.DataFrame, optional
+        meta columns by extract_spec_id. The default is report_lineage.
     Returns
     -------
-    df_out : TYPE
-        DESCRIPTION.
+    df_out : pd.DataFrame
+        rows with the extract and project meta columns.
     """
-    df_out = df_in.copy(deep=True)
-    df_out.drop_duplicates(inplace=True) 
-    df_out = df_out[ ~df_out[agg_col].isnull()].sort_values(by=agg_col)
-    df_out = df_out.groupby(group_cols, as_index=False).agg({agg_col: '|'.join})
+    if lineage is None:
+        lineage = report_lineage
+    df_out = df_in.join(lineage,on='extract_spec_id')
+    for meta_col,source_col in project_meta_values.items():
+        df_out[meta_col] = source_col
+    if cols is not None:
+        positions = {}
+        for position,col in enumerate(df_out.columns):
+            positions.setdefault(col,[]).append(position)
+        n_cols = {col:len(positions[col]) // cols.count(col) for col in cols}
+        order = []
+        for col in cols:
+            order += positions[col][:n_cols[col]]
+            del positions[col][:n_cols[col]]
+        df_out = df_out.iloc[:,order]
     return df_out
 
 
-def join_by_service_target_measure(df_in:pd.DataFrame,service:str,
-                                    target_measure:str,
-                                    grant_or_procurement:str='procurement'
-                                    ) -> pd.DataFrame:
+def spec_columns(specs:pd.DataFrame, worksheet:str) -> tuple:
     """
-    Join by service and target measure
+    Worksheet columns read by the extract specs of a worksheet
     Parameters
     ----------
-    df_in : pd.DataFrame
-        input dataframe.
-    service : str
-        service name.
-    target_measure : str
-        target measure name.
-    grant_or_procurement : str, optional
-        either grant or procurement. The default is 'procurement'.
+    specs : pd.DataFrame
+        extract specs from make_extract_specs.
+    worksheet : str
+        worksheet name.
     Returns
     -------
-    df_out : pd.DataFrame
-        output dataframe.
+    columns : list
+        project and report columns and the columns named by the specs.
+    numeric : list
+        the measured, actual and invoiced columns.
     """
-    df_out = pd.merge(
-        df_in,project_services,
-        on=['merit_project_id','service','target_measure',
-            'report_financial_year'],
-        how='inner') 
-    df_out['grant_or_procurement'] = grant_or_procurement
-    return df_out  
+    specs = specs[specs['worksheet'] == worksheet]
+    numeric = list(pd.unique(
+        specs[['measured','actual','invoiced']].stack().dropna()))
+    named = list(pd.unique(
+        specs[['category','context','species']].stack().dropna()))
+    columns = list(dict.fromkeys(project_cols_in + report_cols_in +
+                                 numeric + named))
+    return columns, numeric
+
+
+def load_worksheets(sheet_names:list, specs:pd.DataFrame=None,
+                    workers:int=None) -> dict:
+    """
+    Loads worksheets from the M files listed for them in worksheet_files.
+    Worksheets in none of their M files are left out.
+    Raises FileNotFoundError when one of the M files does not exist.
+    Parameters
+    ----------
+    sheet_names : list
+        worksheet names.
+    specs : pd.DataFrame, optional
+        extract specs. With schema_reads on only the columns they read are
+        loaded. The default is None, all columns.
+    workers : int, optional
+        processes reading the M files of a worksheet, as for
+        load_mult_wbooks. The default is None, ingest_workers.
+    Returns
+    -------
+    frames : dict
+        worksheet name to worksheet data.
+    """
+    frames = {}
+    for sheet_name in sheet_names:
+        fnames = {file_spec:file_spec + ' ' + extract_date + '.xlsx'
+                  for file_spec in worksheet_files[sheet_name]}
+        missing = [fname for fname in fnames.values()
+                   if not os.path.exists(fname)]
+        if missing:
+            raise FileNotFoundError(
+                "M files of worksheet '{}' not found: {}".format(
+                    sheet_name,', '.join(missing)))
+        files_list = [file_spec for file_spec,fname in fnames.items()
+                      if sheet_name in workbook_sheets(fname)]
+        if len(files_list) == 0:
+            continue
+        columns, numeric = spec_columns(specs,sheet_name) \
+            if schema_reads and specs is not None else (None, None)
+        frames[sheet_name] = load_mult_wbooks(files_list,sheet_name,
+                                              workers=workers,
+                                              columns=columns,numeric=numeric)
+    return frames
+
+
+def set_family_context(context:dict):
+    """
+    Sets the read-only inputs run_family uses, in this process or as the
+    initializer of a pool worker
+    Parameters
+    ----------
+    context : dict
+        services, projects, project_services, all_project_services and
+        ingest_workers.
+    """
+    _family_context.clear()
+    _family_context.update(context)
 
-def make_ref_df(df_in:pd.DataFrame,id_col:str,lookup_col:str,
-                lookup_vals:list) -> pd.DataFrame:
+
+def run_family(worksheet_family:list) -> pd.DataFrame:
     """
-    Does not work
+    Loads a worksheet family and runs its extracts, or for
+    adjustment_family the adjustments, with the inputs set by
+    set_family_context
     Parameters
     ----------
-    df_in : pd.DataFrame
-        DESCRIPTION.
-    *args : list
-        DESCRIPTION.
+    worksheet_family : list
+        worksheet names.
     Returns
     -------
-    df_out : TYPE
-        DESCRIPTION.
+    df_out : pd.DataFrame
+        report rows of the family.
     """
-    df_out = df_in.copy(deep=True)
-    filtered = df_out.lookup_col.isin(lookup_vals)
-    df_out = df_out[filtered][[id_col,lookup_col]]
-    df_out.drop_duplicates(inplace=True)
-    df_out = df_out[~df_out[lookup_col].isnull()]
-    df_out = conc_col(df_out,id_col,lookup_col)
-    return df_out
+    services = _family_context['services']
+    projects = _family_context['projects']
+    project_services = _family_context['project_services']
+    all_project_services = _family_context['all_project_services']
+    workers = _family_context['ingest_workers']
+    if worksheet_family == adjustment_family:
+        adjustments_data = load_mult_wbooks(
+            ['M09'], 'RLP Output Report Adjustment', workers=workers,
+            columns=project_cols_in + report_cols_in + adjustment_cols \
+                if schema_reads else None,
+            numeric=adjustment_cols[2:])
+        if not incremental:
+            return extract_adjustments(adjustments_data,services)
+        return incremental_update(
+            state_name('adjustment_rows',report_lineage,all_project_services,
+                       code=[extract_adjustments]),
+            {'adjustments':adjustments_data,'projects':projects,
+             'project_services':project_services},
+            lambda inputs: extract_adjustments(inputs['adjustments'],
+                                               services))
+    family_frames = load_worksheets(worksheet_family,extract_specs,workers)
+    if not incremental:
+        return extract_batch(family_frames,extract_specs,services)
+    return incremental_update(
+        state_name('report_rows',worksheet_family,extract_specs,
+                   all_project_services,code=[extract_batch]),
+        dict(family_frames,projects=projects,
+             project_services=project_services),
+        lambda inputs: extract_batch(
+            {sheet_name:inputs[sheet_name]
+             for sheet_name in worksheet_family if sheet_name in inputs},
+            extract_specs,services))
+
+
+def spec_labels(args:dict) -> dict:
+    """
+    Profile labels of an extract spec call
+    """
+    labels = {label:args.get(label) for label in
+              ['worksheet','service','target_measure','sub_category']}
+    if labels['worksheet'] is None:
+        labels['worksheet'] = args.get('sheet_name')
+    return labels
 
 
+@profiled(spec_labels)
 def no_category_extract_no_context_no_species(
         df_in:pd.DataFrame, worksheet:str, service:str, target_measure:str,
         measured:str, actual:str, invoiced:str, object_class:str=None, 
         property:str=None, value:str=None, category:str=None, context:str=None, 
-        sub_category:str=None) -> pd.DataFrame:
+        sub_category:str=None,
+        services:ProjectServices=None) -> pd.DataFrame:
     """
     transformation - no_category_extract_no_context_no_species
-''' """
-    
-    df_out = df_in.copy(deep=True)
-    df_out['measured']=df_out[measured]
-    df_out['invoiced']=df_out[invoiced]
-    df_out['actual']=df_out[actual]
-    df_out = df_out[project_cols_in+report_cols_in+\
-                    ['measured','invoiced','actual']]
-    df_out['category'] = 'Various'
-    df_out['context'] = np.nan
-    df_out['report_species'] = np.nan
-    df_out['service'] = service
-    df_out['target_measure'] = target_measure
-    df_out = join_by_service_target_measure(
-        df_out, service, target_measure)
-    
-    if df_out.shape[0]>0:
-        df_out['meta_source_sheetname'] = worksheet
-        df_out['meta_transform_func'] = \
-            'no_category_extract_no_context_no_species'
-        df_out['meta_col_measured'] = measured
-        df_out['meta_col_actual'] = actual
-        df_out['meta_col_invoiced'] = invoiced
-        df_out['meta_col_category'] = category
-        df_out['meta_col_context'] = np.nan
-        df_out['meta_text_subcategory'] = sub_category
-        df_out['meta_col_report_species'] = np.nan
-        df_out['meta_line_item_object_class'] = object_class
-        df_out['meta_line_item_property'] = property
-        df_out['meta_line_item_value'] = value
-    
-    return df_out
+    """
+    return extract_single(
+        'no_category_extract_no_context_no_species', df_in, services,
+        worksheet=worksheet, service=service, target_measure=target_measure,
+        measured=measured, actual=actual, invoiced=invoiced,
+        category=category, sub_category=sub_category, context=context,
+        object_class=object_class, property=property, value=value)
+
+
+@profiled(spec_labels)
 def sub_category_extract_context_no_species(
         df_in:pd.DataFrame, worksheet:str, service:str, target_measure:str,
         measured:str, actual:str, invoiced:str, category:str,sub_category:str,
         context:str,object_class:str=None, property:str=None, value:str=None, 
-        species:str=None) -> pd.DataFrame:
+        species:str=None,
+        services:ProjectServices=None) -> pd.DataFrame:
     """
     transformation - sub_category_extract_no_context_no_species
     Parameters
@@ -272,45 +2925,22 @@ def sub_category_extract_context_no_species(
     df_out : pd.DataFrame
         DESCRIPTION.
     """
-    
-    df_out = df_in.copy(deep=True)
-    df_out['measured']=df_out[measured]
-    df_out['invoiced']=df_out[invoiced]
-    df_out['actual']=df_out[actual]
-    df_out = df_out.rename(columns={category:'category',
-                                    context:'context'})
-    df_out = df_out[project_cols_in+report_cols_in+\
-                    ['measured','invoiced','actual','category','context']]
-    
-    df_out = df_out[df_out['category'] == sub_category]
-    df_out['report_species'] = np.nan
-    df_out['service'] = service
-    df_out['target_measure'] = target_measure
-    df_out = join_by_service_target_measure(
-        df_out, service, target_measure)
-    
-    if df_out.shape[0]>0:
-        df_out['meta_source_sheetname'] = worksheet
-        df_out['meta_transform_func'] = \
-            'sub_category_extract_context_no_species'
-        df_out['meta_col_measured'] = measured
-        df_out['meta_col_actual'] = actual
-        df_out['meta_col_invoiced'] = invoiced
-        df_out['meta_col_category'] = category
-        df_out['meta_col_context'] = context
-        df_out['meta_text_subcategory'] = sub_category
-        df_out['meta_col_report_species'] = np.nan
-        df_out['meta_line_item_object_class'] = object_class
-        df_out['meta_line_item_property'] = property
-        df_out['meta_line_item_value'] = value
-    
-    return df_out
+    return extract_single(
+        'sub_category_extract_context_no_species', df_in, services,
+        worksheet=worksheet, service=service, target_measure=target_measure,
+        measured=measured, actual=actual, invoiced=invoiced,
+        category=category, sub_category=sub_category, context=context,
+        species=species, object_class=object_class, property=property,
+        value=value)
+
 
+@profiled(spec_labels)
 def sub_category_extract_no_context_no_species(
         df_in:pd.DataFrame, worksheet:str, service:str, target_measure:str,
         measured:str, actual:str, invoiced:str, category:str, 
         sub_category:str, context:str=None, object_class=None, 
-        property:str=None, species:str=None, value:str=None) -> pd.DataFrame:
+        property:str=None, species:str=None, value:str=None,
+        services:ProjectServices=None) -> pd.DataFrame:
     """
     transformation - sub_category_extract_no_context_no_species
     Parameters
@@ -346,116 +2976,295 @@ def sub_category_extract_no_context_no_species(
     df_out : pd.DataFrame
         DESCRIPTION.
     """
-    
-    df_out = df_in.copy(deep=True)
-    df_out['measured'] = df_out[measured]
-    df_out['invoiced'] = df_out[invoiced]
-    df_out['actual'] =  df_out[actual]
-    df_out = df_out.rename(columns={category:'category'})
-    df_out = df_out[project_cols_in+report_cols_in+\
-                    ['measured','invoiced','actual','category']]
-    df_out = df_out[df_out['category'] == sub_category]
-    df_out['context'] = np.nan
-    df_out['report_species'] = np.nan
-    df_out['service'] = service
-    df_out['target_measure'] = target_measure
-    df_out = join_by_service_target_measure(
-        df_out, service, target_measure)
-    
-    if df_out.shape[0]>0:
-        df_out['meta_source_sheetname'] = worksheet
-        df_out['meta_transform_func'] = \
-            'sub_category_extract_no_context_no_species'
-        df_out['meta_col_measured'] = measured
-        df_out['meta_col_actual'] = actual
-        df_out['meta_col_invoiced'] = invoiced
-        df_out['meta_col_category'] = category
-        df_out['meta_col_context'] = np.nan
-        df_out['meta_text_subcategory'] = sub_category
-        df_out['meta_col_report_species'] = np.nan
-        df_out['meta_line_item_object_class'] = object_class
-        df_out['meta_line_item_property'] = property
-        df_out['meta_line_item_value'] = value
-    return df_out
+    return extract_single(
+        'sub_category_extract_no_context_no_species', df_in, services,
+        worksheet=worksheet, service=service, target_measure=target_measure,
+        measured=measured, actual=actual, invoiced=invoiced,
+        category=category, sub_category=sub_category, context=context,
+        species=species, object_class=object_class, property=property,
+        value=value)
 
 
+@profiled(spec_labels)
 def no_category_extract_context_species(
         df_in:pd.DataFrame, worksheet:str, service:str, target_measure:str,
         measured:str, actual:str, invoiced:str,context:str,species:str,
         object_class=None, property:str=None,value:str=None,
-        sub_category:str=None,category:str=None) -> pd.DataFrame:
-    df_out = df_in.copy(deep=True)
-    df_out['measured']=df_out[measured]
-    df_out['invoiced']=df_out[invoiced]
-    df_out['actual']=df_out[actual]
-    df_out = df_out.rename(columns={species:'species'})
-    df_out = df_out[project_cols_in+report_cols_in+\
-                    ['measured','invoiced','actual','species']]
-    
-    df_out['category'] = 'Various'
-    df_out['context'] = np.nan
-    df_out['service'] = service
-    df_out['target_measure'] = target_measure
-    df_out = join_by_service_target_measure(
-        df_out, service, target_measure)
-    
-    if df_out.shape[0]>0:
-        df_out['meta_source_sheetname'] = worksheet
-        df_out['meta_transform_func'] = \
-            'no_category_extract_context_species'
-        df_out['meta_col_measured'] = measured
-        df_out['meta_col_actual'] = actual
-        df_out['meta_col_invoiced'] = invoiced
-        df_out['meta_col_category'] = category
-        df_out['meta_col_context'] = np.nan
-        df_out['meta_text_subcategory'] = np.nan
-        df_out['meta_col_report_species'] = np.nan
-        df_out['meta_line_item_object_class'] = object_class
-        df_out['meta_line_item_property'] = property
-        df_out['meta_line_item_value'] = value
-    return df_out
+        sub_category:str=None,category:str=None,
+        services:ProjectServices=None) -> pd.DataFrame:
+    """
+    transformation - no_category_extract_context_species
+    """
+    return extract_single(
+        'no_category_extract_context_species', df_in, services,
+        worksheet=worksheet, service=service, target_measure=target_measure,
+        measured=measured, actual=actual, invoiced=invoiced,
+        category=category, sub_category=sub_category, context=context,
+        species=species, object_class=object_class, property=property,
+        value=value)
 
 
+@profiled(spec_labels)
 def no_category_extract_context_no_species(
         df_in:pd.DataFrame, worksheet:str, service:str, target_measure:str,
         measured:str, actual:str, invoiced:str,context:str,object_class=None, 
         property:str=None,value:str=None,sub_category:str=None,
-        category:str=None,species:str=None) -> pd.DataFrame:
-    df_out = df_in.copy(deep=True)
-   
-    df_out['measured']=df_out[measured]
-    df_out['invoiced']=df_out[invoiced]
-    df_out['actual']=df_out[actual]
-    df_out = df_out[project_cols_in+report_cols_in+\
-                    ['measured','invoiced','actual']]
-    df_out['category'] = 'Various'
-    df_out['context'] = np.nan
-    df_out['report_species'] = np.nan
-    df_out['service'] = service
-    df_out['target_measure'] = target_measure
-    df_out = join_by_service_target_measure(
-        df_out, service, target_measure)
-    
-    if df_out.shape[0]>0:
-        df_out['meta_source_sheetname'] = worksheet
-        df_out['meta_transform_func'] = \
-            'no_category_extract_context_no_species'
-        df_out['meta_col_measured'] = measured
-        df_out['meta_col_actual'] = actual
-        df_out['meta_col_invoiced'] = invoiced
-        df_out['meta_col_category'] = category
-        df_out['meta_col_context'] = np.nan
-        df_out['meta_text_subcategory'] = np.nan
-        df_out['meta_col_report_species'] = np.nan
-        df_out['meta_line_item_object_class'] = object_class
-        df_out['meta_line_item_property'] = property
-        df_out['meta_line_item_value'] = value
-    return df_out
+        category:str=None,species:str=None,
+        services:ProjectServices=None) -> pd.DataFrame:
+    """
+    transformation - no_category_extract_context_no_species
+    """
+    return extract_single(
+        'no_category_extract_context_no_species', df_in, services,
+        worksheet=worksheet, service=service, target_measure=target_measure,
+        measured=measured, actual=actual, invoiced=invoiced,
+        category=category, sub_category=sub_category, context=context,
+        species=species, object_class=object_class, property=property,
+        value=value)
+
+
+@profiled(spec_labels)
+def sub_category_extract_context_species(
+        df_in:pd.DataFrame, worksheet:str, service:str, target_measure:str,
+        measured:str, actual:str, invoiced:str, category:str,
+        sub_category:str, context:str, species:str, object_class:str=None,
+        property:str=None, value:str=None,
+        services:ProjectServices=None) -> pd.DataFrame:
+    """
+    transformation - sub_category_extract_context_species
+    """
+    return extract_single(
+        'sub_category_extract_context_species', df_in, services,
+        worksheet=worksheet, service=service, target_measure=target_measure,
+        measured=measured, actual=actual, invoiced=invoiced,
+        category=category, sub_category=sub_category, context=context,
+        species=species, object_class=object_class, property=property,
+        value=value)
+
+
+@profiled(spec_labels)
+def sub_category_extract_no_context_species(
+        df_in:pd.DataFrame, worksheet:str, service:str, target_measure:str,
+        measured:str, actual:str, invoiced:str, category:str,
+        sub_category:str, species:str, object_class:str=None,
+        property:str=None, value:str=None, context:str=None,
+        services:ProjectServices=None) -> pd.DataFrame:
+    """
+    transformation - sub_category_extract_no_context_species
+    """
+    return extract_single(
+        'sub_category_extract_no_context_species', df_in, services,
+        worksheet=worksheet, service=service, target_measure=target_measure,
+        measured=measured, actual=actual, invoiced=invoiced,
+        category=category, sub_category=sub_category, context=context,
+        species=species, object_class=object_class, property=property,
+        value=value)
+
+
+@profiled(spec_labels)
+def all_sub_category_extract_no_context_no_species(
+        df_in:pd.DataFrame, worksheet:str, service:str, target_measure:str,
+        measured:str, actual:str, invoiced:str, category:str,
+        object_class:str=None, property:str=None, value:str=None,
+        context:str=None, species:str=None, sub_category:str=None,
+        services:ProjectServices=None) -> pd.DataFrame:
+    """
+    transformation - all_sub_category_extract_no_context_no_species, every
+    category rather than one sub category
+    """
+    return extract_single(
+        'all_sub_category_extract_no_context_no_species', df_in, services,
+        worksheet=worksheet, service=service, target_measure=target_measure,
+        measured=measured, actual=actual, invoiced=invoiced,
+        category=category, sub_category=sub_category, context=context,
+        species=species, object_class=object_class, property=property,
+        value=value)
+
+
+@profiled(spec_labels)
+def all_sub_category_extract_context_no_species(
+        df_in:pd.DataFrame, worksheet:str, service:str, target_measure:str,
+        measured:str, actual:str, invoiced:str, category:str, context:str,
+        object_class:str=None, property:str=None, value:str=None,
+        species:str=None, sub_category:str=None,
+        services:ProjectServices=None) -> pd.DataFrame:
+    """
+    transformation - all_sub_category_extract_context_no_species
+    """
+    return extract_single(
+        'all_sub_category_extract_context_no_species', df_in, services,
+        worksheet=worksheet, service=service, target_measure=target_measure,
+        measured=measured, actual=actual, invoiced=invoiced,
+        category=category, sub_category=sub_category, context=context,
+        species=species, object_class=object_class, property=property,
+        value=value)
+
+
+@profiled(spec_labels)
+def all_sub_category_extract_context_species(
+        df_in:pd.DataFrame, worksheet:str, service:str, target_measure:str,
+        measured:str, actual:str, invoiced:str, category:str, context:str,
+        species:str, object_class:str=None, property:str=None,
+        value:str=None, sub_category:str=None,
+        services:ProjectServices=None) -> pd.DataFrame:
+    """
+    transformation - all_sub_category_extract_context_species
+    """
+    return extract_single(
+        'all_sub_category_extract_context_species', df_in, services,
+        worksheet=worksheet, service=service, target_measure=target_measure,
+        measured=measured, actual=actual, invoiced=invoiced,
+        category=category, sub_category=sub_category, context=context,
+        species=species, object_class=object_class, property=property,
+        value=value)
+
+
+@profiled(spec_labels)
+def grant_report_no_species(
+        df_in:pd.DataFrame, sheet_name:str, measured_col:str, actual_col:str,
+        invoiced_col:str, context_col:str, object_class:str=None,
+        property:str=None, value:str=None) -> pd.DataFrame:
+    """
+    transformation - grant_report_no_species, a grant activity worksheet
+    measured by measured_col, not joined to the project services
+    """
+    return extract_single(
+        'grant_report_no_species', df_in, None,
+        worksheet=sheet_name, target_measure=measured_col,
+        measured=measured_col, actual=actual_col, invoiced=invoiced_col,
+        context=context_col, object_class=object_class, property=property,
+        value=value)
+
+
+@profiled(spec_labels)
+def grant_report_species(
+        df_in:pd.DataFrame, sheet_name:str, measured_col:str, actual_col:str,
+        invoiced_col:str, context_col:str, species_col:str,
+        object_class:str=None, property:str=None,
+        value:str=None) -> pd.DataFrame:
+    """
+    transformation - grant_report_species, the rows with a species
+    """
+    return extract_single(
+        'grant_report_species', df_in, None,
+        worksheet=sheet_name, target_measure=measured_col,
+        measured=measured_col, actual=actual_col, invoiced=invoiced_col,
+        context=context_col, species=species_col, object_class=object_class,
+        property=property, value=value)
+
+
+@profiled(spec_labels)
+def grant_report_species_category(
+        df_in:pd.DataFrame, sheet_name:str, category_col:str,
+        measured_col:str, actual_col:str, invoiced_col:str, context_col:str,
+        species_col:str, object_class:str=None, property:str=None,
+        value:str=None, sub_category:str=None) -> pd.DataFrame:
+    """
+    transformation - grant_report_species_category
+    """
+    return extract_single(
+        'grant_report_species_category', df_in, None,
+        worksheet=sheet_name, target_measure=measured_col,
+        measured=measured_col, actual=actual_col, invoiced=invoiced_col,
+        category=category_col, sub_category=sub_category,
+        context=context_col, species=species_col, object_class=object_class,
+        property=property, value=value)
+
+
+@profiled(spec_labels)
+def grant_report_species_no_metrics(
+        df_in:pd.DataFrame, sheet_name:str, context_col:str,
+        species_col:str, object_class:str=None, property:str=None,
+        value:str=None) -> pd.DataFrame:
+    """
+    transformation - grant_report_species_no_metrics, species rows with
+    measured_missing and actual_missing and no invoiced value
+    """
+    return extract_single(
+        'grant_report_species_no_metrics', df_in, None,
+        worksheet=sheet_name, target_measure=species_col,
+        context=context_col, species=species_col, object_class=object_class,
+        property=property, value=value)
 
-    
 
 extract_date = '2022-07-18'
 version = '1.0.1'
+
+# Stage cache - stage outputs kept under a key of their code and inputs
+use_stage_cache = True
+stage_cache_dir = './stage_cache'
+
+# Workbook cache - each workbook is parsed once into parquet sidecars
+use_workbook_cache = True
+workbook_cache_dir = './workbook_cache'
+
+# Lookup store - the lookup pickles converted once into memory mapped
+# Arrow files, loaded by column
+use_lookup_store = True
+lookup_store_dir = './lookup_store'
+
+# Worker processes for reading the M files of a worksheet family
+ingest_workers = min(5,os.cpu_count() or 1)
+
+# Worker processes running the worksheet families of report_raw in
+# parallel, each family loaded and extracted in one worker
+family_workers = 1
+
+# Out of core - report_raw and the stages after it spilled to shard_dir,
+# hash partitioned by merit_project_id into shards sized to
+# memory_budget_mb, and run a shard at a time
+out_of_core = False
+shard_dir = './shards'
+memory_budget_mb = 2048
+
+# Keep the SGE project services grid unexpanded until it is joined
+lazy_service_grid = False
+
+# Index project_services once for join_by_service_target_measure
+index_project_services = True
+
+# Carry an extract_spec_id per row in place of the constant meta columns,
+# expanded from report_lineage by expand_lineage. With
+# export_expand_lineage on the exports write the meta columns, else
+# extract_spec_id
+compact_lineage = False
+export_expand_lineage = True
+
+# Recompute report rows and project aggregates only for projects whose
+# input rows changed since the state saved in incremental_state_dir
+incremental = False
+incremental_state_dir = './incremental_state'
+
+# Read only the worksheet columns the extracts use, numbers and dates typed
+schema_reads = True
+
+# Store low cardinality text columns (category_cols) as shared categoricals
+compact_dtypes = False
+
+# Export - stream the analytical datasets to Parquet in export_dir, hive
+# partitioned by export_partition_cols
+export_parquet_files = False
+export_dir = './export'
+export_chunk_rows = 65536
+export_row_group_rows = 131072
+# Write the analytical dataset multi line workbook to export_dir as well
+export_excel = False
+# Load the exports and lookups into a SQLite database in export_dir
+export_sqlite = False
+
+# Run the extracts, project services joins, conc_col and project attribute
+# joins as Polars lazy queries ('polars') or with pandas ('pandas', the
+# reference). With check_backend on, a run also runs the targets again with
+# each backend and prints how their outputs differ
+backend = 'pandas'
+check_backend = False
+
+# Profile the reads, extracts, joins and aggregations of a run into
+# profile_dir, printing the profile_top_n slowest
+profile_calls = False
+profile_dir = './profile'
+profile_top_n = 15
+
 measured_missing, \
     actual_missing,\
     invoiced_missing,\
@@ -490,6 +3299,19 @@ report_cols_out = \
     'report_species','total_to_be_delivered','fy_target','measured','invoiced',
     'actual','report_stage','report_activity_id','report_activity_type',
     'report_from_date','report_to_date']
+# project meta column: source column name
+project_meta_values = \
+    {'meta_col_project_status':'status',
+     'meta_col_report_last_modified':'last_modified_2',
+     'meta_col_report_stage':'stage',
+     'meta_col_report_activity_id':'activity_id',
+     'meta_col_report_activity_type':'activity_type',
+     'meta_col_project_start_date':'start_date',
+     'meta_col_project_end_date':'end_date',
+     'meta_col_project_contracted_start_date':'contracted_start_date',
+     'meta_col_project_contracted_end_date':'contracted_end_date',
+     'meta_col_project_name':'name'}
+
 report_meta_cols_out = \
     ['meta_col_measured','meta_col_actual','meta_col_invoiced',
      'meta_col_category','meta_text_subcategory','meta_col_context',
@@ -512,6 +3334,10 @@ species_etc_cols_out = \
       'remnant_vegetation','aquatic_and_coastal_systems_including_wetlands',
       'report_species','epbc','tec','ramsar','version']
 
+# delimiters of the report species lists, as the R report_species step
+# splits them
+species_split_pattern = '[,|]'
+
 numeric_cols = \
     ['measured','invoiced','actual','report_from_date','report_to_date',
      'start_date','end_date','contracted_start_date','contracted_end_date',
@@ -521,8 +3347,84 @@ character_cols = \
     ['management_unit','external_id','site_id','organisation',
      'report_species','category','context']
 
+category_cols = \
+    ['service','target_measure','report_financial_year','report_status',
+     'category','context','management_unit','program','sub_program',
+     'status','stage','activity_type']
+
+date_cols = \
+    ['start_date','end_date','contracted_start_date','contracted_end_date',
+     'last_modified','last_modified_1','last_modified_2','report_from_date',
+     'report_to_date']
+
 extract_date_cols = ['version','grant_or_procurement','extract_date']
 
+lookup_files = \
+    {'management_units':'management_units.pkl',
+     'investment_priority_themes':'investment_priority_themes.pkl',
+     'all_project_services':'all_project_services.pkl'}
+
+lookup_renames = \
+    {'management_units':
+         {'investment_priority_derived':'merit_lookup',
+          'investment_priority':'mu_state'},
+     'investment_priority_themes':
+         {'management_unit_id':'mu_id',
+          'investment_priority_derived':'investment_priority',
+          'short_term_indicator':'short_term_outcome_indicator_outcome'}}
+
+export_tables = ['project_reports','projects_reports_species',
+                 'project_species']
+
+# columns of the tables with report lineage, with the meta columns
+lineage_tables = \
+    {'project_reports':
+         project_cols_out + report_cols_out + project_meta_cols_out + \
+         report_meta_cols_out + extract_date_cols,
+     'projects_reports_species':
+         project_cols_out + report_cols_out + project_meta_cols_out + \
+         report_meta_cols_out + species_etc_cols_out + extract_date_cols}
+
+# worksheet name to table, in workbook order
+excel_sheets = \
+    {'Projects-Species':'project_species',
+     'Project Services':'project_services',
+     'Projects-Reports-Species':'projects_reports_species',
+     'MetaData':'metadata'}
+
+excel_max_rows = 1048576
+
+excel_header_style = \
+    {'font_size':11,'font_name':'Arial','bold':True,'align':'left',
+     'font_color':'white','bg_color':'black','border':1}
+
+database_indexes = \
+    [['merit_project_id'],['service','target_measure'],
+     ['report_financial_year']]
+
+export_partition_cols = \
+    ['extract_date','report_financial_year','management_unit']
+
+service_keys = \
+    ['merit_project_id','service','target_measure','report_financial_year']
+
+# report row number kept through the lazy project services joins
+report_row_col = 'report_row_'
+
+financial_years = \
+    ['2018/2019','2019/2020','2020/2021','2021/2022','2022/2023']
+
+outcome_types = ['Primary outcome','Secondary Outcome/s']
+
+# value column: (primary and secondary, primary, secondary) output columns
+outcome_summary_cols = \
+    {'outcome':
+         ['primary_secondary_outcomes','primary_outcomes',
+          'secondary_outcomes'],
+     'investment_priority':
+         ['primary_secondary_investment_priorities',
+          'primary_investment_priority','secondary_investment_priority']}
+
 meri_outcomes_indicator_ref = \
     ["natural_cultural_assets_managed","threatened_species",
     "threatened_ecological_communities", "migratory_species",
@@ -537,601 +3439,559 @@ meri_outcomes_indicator_ref = \
 adjustment_cols = \
   ['project_service','output_measure','reported_measure_requiring_adjustment',
     'adjustment']
-    
-# management_units = pd.read_csv('management_units.csv')
-# management_units.to_pickle("./management_units.pkl")  
-management_units = pd.read_pickle("management_units.pkl")
-management_units.rename({'investment_priority_derived':'merit_lookup',
-             'investment_priority':'mu_state'},
-            axis=1,inplace=True)
 
-# investment_priority_themes = pd.read_excel('investment_priority_themes.xlsx')
-# investment_priority_themes.to_pickle("./investment_priority_themes.pkl")  
-
-
-investment_priority_themes = pd.read_pickle("./investment_priority_themes.pkl").\
-rename(
-    {'management_unit_id':'mu_id',
-     'investment_priority_derived':'investment_priority',
-     'short_term_indicator':'short_term_outcome_indicator_outcome'},
-     axis=1)
-
-# all_project_services = pd.read_excel('all_project_services.xlsx')
-# all_project_services.to_pickle("./all_project_services.pkl")
-
-all_project_services = pd.read_pickle("./all_project_services.pkl").\
-    clean_names()
-
-
-RLP_Outcomes = read_sheet('RLP Outcomes','M01 '+extract_date+'.xlsx',
-                          start_row = 0).\
-    rename({'merit_project_id':'grant_id'})
-    
-    
-RLP_Outcomes_investment_priority = RLP_Outcomes.copy(deep=True)
-RLP_Outcomes_investment_priority['investment_priority'] = \
-    RLP_Outcomes_investment_priority['investment_priority'].str.split(',')
-RLP_Outcomes_investment_priority = \
-    RLP_Outcomes_investment_priority.explode('investment_priority')
-RLP_Outcomes_investment_priority['investment_priority'] = \
-    RLP_Outcomes_investment_priority['investment_priority'].str.strip()
-RLP_Outcomes_investment_priority= \
-        pd.merge(RLP_Outcomes_investment_priority,investment_priority_themes,
-                 how='left',on='investment_priority')
-    
-epbc = get_indicator(RLP_Outcomes_investment_priority,
-                     'epbc','Threatened Species')  
-
-tec = get_indicator(RLP_Outcomes_investment_priority,
-                     'tec','Threatened Ecological Community')     
+adjustment_meta = \
+    {'meta_source_sheetname':'RLP Output Report Adjustment',
+     'meta_transform_func':'Adjustment Reports',
+     'meta_col_actual':'reported_measure_requiring_adjustment',
+     'meta_col_invoiced':'adjustment'}
+
+# Extracts
+extract_spec_cols = \
+    ['worksheet','transform_func','service','target_measure','measured',
+     'actual','invoiced','category','sub_category','context','species',
+     'object_class','property','value']
+
+extract_meta_cols = \
+    ['meta_source_sheetname','meta_transform_func','meta_col_measured',
+     'meta_col_actual','meta_col_invoiced','meta_col_category',
+     'meta_col_context','meta_text_subcategory','meta_col_report_species',
+     'meta_line_item_object_class','meta_line_item_property',
+     'meta_line_item_value']
+
+# transform function: (reads category, matches sub_category, reads context,
+# reads species, joins project services)
+extract_shapes = \
+    {'no_category_extract_no_context_no_species':
+         (False,False,False,False,True),
+     'no_category_extract_context_no_species':(False,False,True,False,True),
+     'no_category_extract_context_species':(False,False,True,True,True),
+     'sub_category_extract_no_context_no_species':
+         (True,True,False,False,True),
+     'sub_category_extract_context_no_species':(True,True,True,False,True),
+     'sub_category_extract_no_context_species':(True,True,False,True,True),
+     'sub_category_extract_context_species':(True,True,True,True,True),
+     'all_sub_category_extract_no_context_no_species':
+         (True,False,False,False,True),
+     'all_sub_category_extract_context_no_species':
+         (True,False,True,False,True),
+     'all_sub_category_extract_context_species':(True,False,True,True,True),
+     'grant_report_no_species':(False,False,True,False,False),
+     'grant_report_species':(False,False,True,True,False),
+     'grant_report_species_category':(True,False,True,True,False),
+     'grant_report_species_no_metrics':(False,False,True,True,False)}
+
+# stages after report_raw, run shard by shard out of core, in order
+sharded_stages = ['project_reports','project_attrs',
+                  'projects_reports_species','project_species']
+
+# memory the sharded stages need per byte of report rows
+shard_memory_factor = 8
+
+adjustment_family = ['RLP Output Report Adjustment']
+
+# Extract specs - one row per extract of the R script, with the worksheet
+# family and M files of its worksheet, run a worksheet family at a time
+extract_specs_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'extract_specs.csv')
+
+extract_specs, worksheet_files, worksheet_families = \
+    read_extract_specs(extract_specs_file)
+worksheet_files[adjustment_family[0]] = ['M09']
+
+# Lineage - the meta columns of each extract spec, plus the adjustments
+adjustment_spec_id = extract_specs.shape[0]
+report_lineage = pd.concat([
+    extract_meta(extract_specs),
+    pd.DataFrame([adjustment_meta],index=[adjustment_spec_id],
+                 columns=extract_meta_cols)])
+
+# Pipeline stages - each run by run_stages, cached under a key of its
+# code, settings, input stages and source files
+@pipeline_stage('lookups',files=lambda: list(lookup_files.values()))
+def stage_lookups() -> dict:
+    """
+    Lookup tables
+    Returns
+    -------
+    lookups : dict
+        management_units, investment_priority_themes and all_project_services.
+    """
+    # management_units = pd.read_csv('management_units.csv')
+    # management_units.to_pickle("./management_units.pkl")  
+    management_units = load_lookup('management_units')
+    if compact_dtypes:
+        management_units = compact_categories(management_units)
+
+    # investment_priority_themes = pd.read_excel('investment_priority_themes.xlsx')
+    # investment_priority_themes.to_pickle("./investment_priority_themes.pkl")  
+    investment_priority_themes = load_lookup('investment_priority_themes')
+
+    # all_project_services = pd.read_excel('all_project_services.xlsx')
+    # all_project_services.to_pickle("./all_project_services.pkl")
+    all_project_services = load_lookup('all_project_services',
+                                       ['service','target_measure'])
+    return {'management_units':management_units,
+            'investment_priority_themes':investment_priority_themes,
+            'all_project_services':all_project_services}
+
+
+@pipeline_stage('m01_sheets',
+                files=lambda: ['M01 '+extract_date+'.xlsx'])
+def stage_m01_sheets() -> dict:
+    """
+    Project level worksheets of the M01 workbook
+    Returns
+    -------
+    sheets : dict
+        RLP_Outcomes, projects, project_services_RLP, project_assets,
+        meri_outcomes and meri_priorities.
+    """
+    RLP_Outcomes = read_sheet('RLP Outcomes','M01 '+extract_date+'.xlsx',
+                              start_row = 0).\
+        rename({'merit_project_id':'grant_id'})
+
+    projects = read_sheet('Projects',
+                          'M01 '+extract_date+'.xlsx',
+                          start_row = 0)
+
+    project_services_RLP_cols = \
+        ['merit_project_id','service','target_measure',
+         'total_to_be_delivered','2018_2019','2019_2020','2020_2021',
+         '2021_2022','2022_2023']
+    project_services_RLP = read_sheet('Project services and targets',
+                                      'M01 '+extract_date+'.xlsx',
+                                      start_row = 0,
+                                      columns = project_services_RLP_cols \
+                                          if schema_reads else None)\
+        [project_services_RLP_cols]
+
+    project_assets = read_sheet('MERI_Project Assets',
+                                'M01 '+extract_date+'.xlsx',
+                                start_row=0,
+                                columns=['merit_project_id','asset'] \
+                                    if schema_reads else None)\
+        [['merit_project_id','asset']]
+
+    meri_outcomes_cols = ['merit_project_id'] + meri_outcomes_indicator_ref
+    meri_outcomes = read_sheet('MERI_Outcomes','M01 '+extract_date+'.xlsx',
+                                start_row=0,
+                                columns=meri_outcomes_cols \
+                                    if schema_reads else None)\
+        [meri_outcomes_cols]
+
+    meri_priorities_cols = ['merit_project_id','document_name',
+                            'relevant_section',
+                            'explanation_of_strategic_alignment']
+    meri_priorities = read_sheet('MERI_Priorities',
+                                 'M01 '+extract_date+'.xlsx',
+                                 start_row=0,
+                                 columns=meri_priorities_cols \
+                                     if schema_reads else None)\
+        [meri_priorities_cols]
+    return {'RLP_Outcomes':RLP_Outcomes,'projects':projects,
+            'project_services_RLP':project_services_RLP,
+            'project_assets':project_assets,'meri_outcomes':meri_outcomes,
+            'meri_priorities':meri_priorities}
+
+
+def sge_ids(projects:pd.DataFrame) -> pd.Series:
+    """
+    merit_project_id of the State Government Emergency projects
+    """
+    return projects[projects['sub_program']=='State Government Emergency']\
+        ['merit_project_id'] 
 
-ramsar = get_indicator(RLP_Outcomes_investment_priority,
-                     'ramsar','Ramsar')    
-    
-projects = read_sheet('Projects',
-                      'M01 '+extract_date+'.xlsx',
-                      start_row = 0)
-
-project_services_RLP = read_sheet('Project services and targets',
-                                  'M01 '+extract_date+'.xlsx',
-                                  start_row = 0)\
-    [['merit_project_id','service','target_measure','total_to_be_delivered',
-          '2018_2019','2019_2020','2020_2021','2021_2022','2022_2023']]
-    
-project_services_RLP = pd.melt(project_services_RLP,id_vars = \
-                               ['merit_project_id','service',
-                                'target_measure','total_to_be_delivered'],
-                               var_name='report_financial_year',
-                               value_name='fy_target')
- 
-project_services_RLP.report_financial_year = project_services_RLP.\
-    report_financial_year.\
-        replace('[_]','/',regex=True)
- 
-SGE_ids = projects[projects['sub_program']=='State Government Emergency']\
-    ['merit_project_id'] 
 
-    
-project_services = pd.concat(
-    [ids_by_df(SGE_ids, all_project_services,'2018/2019'),
-     ids_by_df(SGE_ids, all_project_services,'2019/2020'),
-     ids_by_df(SGE_ids, all_project_services,'2020/2021'),
-     ids_by_df(SGE_ids, all_project_services,'2021/2022'),
-     ids_by_df(SGE_ids, all_project_services,'2022/2023'),
-     project_services_RLP])
-
-RLP_Data = load_mult_wbooks(['M02','M05','M07','M08','M09'],
-                             'RLP - Baseline da...tput Report')
-BR_Data = load_mult_wbooks(['M05'],'Baseline data Sta...inal Report')
-
-report_raw = pd.concat([
-    no_category_extract_no_context_no_species( 
-        df_in = RLP_Data,
-        worksheet = 'RLP - Baseline da...tput Report',
-        service = 'Collecting, or synthesising baseline data',
-        target_measure = 'Number of baseline data sets collected and/or synthesised',
-        measured = 'number_of_baseline_data_sets_collected_and_or_synthesised',
-        invoiced = 'number_of_baseline_data_sets_collected_and_or_synthesised',
-        actual = 'number_of_baseline_data_sets_collected_and_or_synthesised',
-        object_class = 'Baseline Data',
-        property = 'collected and/or synthesised',
-        value = 'Total Data Sets'
-        ),
-    no_category_extract_no_context_no_species(
-        df_in = BR_Data,
-        worksheet = 'Baseline data Sta...inal Report',
-        service = "Collecting, or synthesising baseline data",
-        target_measure = "Number of baseline data sets collected and/or synthesised",
-        measured = 'number_of_baseline_data_sets_collected_and_or_synthesised',
-        invoiced = 'number_of_baseline_data_sets_collected_and_or_synthesised',
-        actual = 'number_of_baseline_data_sets_collected_and_or_synthesised',
-        object_class = 'Baseline data sets',
-        property = 'collected and/or synthesised',
-        value = 'Total Data Sets')])
-
-RLP_Data = load_mult_wbooks(['M02','M05','M07','M08','M09'],
-                             'RLP - Community e...tput Report')
-BR_Data = load_mult_wbooks(['M05'],'Community engagem...inal Report')
-
-report_raw = pd.concat([
-    report_raw,
-    sub_category_extract_no_context_no_species(
-        df_in = BR_Data,
-        worksheet = 'Community engagem...inal Report',
-        service = "Community/stakeholder engagement",
-        target_measure = "Number of conferences / seminars",
-        measured = 'number_of_community_stakeholder_engagement_type_events',
-        invoiced = 'number_of_community_stakeholder_engagement_type_events',
-        actual = 'number_of_community_stakeholder_engagement_type_events',
-        category = 'type_of_community_stakeholder_engagement_activity',
-        sub_category = 'Conferences / seminars',
-        context = 'purpose_of_engagement',
-        object_class = 'Community Engagement',
-        property = 'conferences / seminars',
-        value ='Total Events'),
-    sub_category_extract_no_context_no_species(
-        df_in = RLP_Data,
-        worksheet = 'RLP - Community e...tput Report',
-        service = 'Community/stakeholder engagement',
-        target_measure = 'Number of field days',
-        measured = 'number_of_community_stakeholder_engagement_type_events',
-        invoiced = 'number_of_community_stakeholder_engagement_type_events',
-        actual = 'number_of_community_stakeholder_engagement_type_events',
-        category = 'type_of_community_stakeholder_engagement_activity',
-        sub_category = 'Field days',
-        object_class = 'Community Engagement', 
-        property = 'field days',
-        value = 'Total Events'),
-    sub_category_extract_context_no_species(
-        df_in = BR_Data,
-        worksheet = 'Community engagem...inal Report',
-        service = 'Community/stakeholder engagement',
-        target_measure = 'Number of field days',
-        measured = 'number_of_community_stakeholder_engagement_type_events',
-        invoiced = 'number_of_community_stakeholder_engagement_type_events',
-        actual = 'number_of_community_stakeholder_engagement_type_events',
-        category = 'type_of_community_stakeholder_engagement_activity',
-        sub_category = 'Field days',
-        context = 'purpose_of_engagement',
-        object_class = 'Community Engagement',
-        property = 'field days',
-        value = 'Total Events'),
-    sub_category_extract_context_no_species(
-        df_in = RLP_Data,
-        worksheet = 'RLP - Community e...tput Report',
-        service = 'Community/stakeholder engagement',
-        target_measure = 'Number of on-ground trials / demonstrations',
-        measured = 'number_of_community_stakeholder_engagement_type_events',
-        invoiced = 'number_of_community_stakeholder_engagement_type_events',
-        actual = 'number_of_community_stakeholder_engagement_type_events',
-        category = 'type_of_community_stakeholder_engagement_activity',
-        sub_category = 'On-ground trials / demonstrations',
-        context = 'purpose_of_engagement',
-        object_class = 'Community Engagement',
-        property = 'On-ground trials / demonstrations',
-        value = 'Total Events'),
-    sub_category_extract_context_no_species(
-        df_in = BR_Data,
-        worksheet = 'Community engagem...inal Report',
-        service = 'Community/stakeholder engagement',
-        target_measure = 'Number of on-ground trials / demonstrations',
-        measured = 'number_of_community_stakeholder_engagement_type_events',
-        invoiced = 'number_of_community_stakeholder_engagement_type_events',
-        actual = 'number_of_community_stakeholder_engagement_type_events',
-        category = 'type_of_community_stakeholder_engagement_activity',
-        sub_category = 'On-ground trials / demonstrations',
-        context = 'purpose_of_engagement',
-        object_class = 'Community Engagement',
-        property = 'On-ground trials / demonstrations',
-        value = 'Total Events'),
-    sub_category_extract_context_no_species(
-        df_in = RLP_Data,
-        worksheet = 'RLP - Community e...tput Report',
-        service = 'Community/stakeholder engagement',
-        target_measure = 'Number of on-ground works',
-        measured = 'number_of_community_stakeholder_engagement_type_events',
-        invoiced = 'number_of_community_stakeholder_engagement_type_events',
-        actual = 'number_of_community_stakeholder_engagement_type_events',
-        category = 'type_of_community_stakeholder_engagement_activity',
-        context = 'purpose_of_engagement',
-        sub_category = 'On-ground works',
-        object_class = 'Community Engagement',
-        property = 'on-ground works',
-        value = 'Total Events'),
-    sub_category_extract_context_no_species(
-        df_in = BR_Data,
-        worksheet = 'Community engagem...inal Report',
-        service = 'Community/stakeholder engagement',
-        target_measure = 'Number of on-ground works',
-        measured = 'number_of_community_stakeholder_engagement_type_events',
-        invoiced = 'number_of_community_stakeholder_engagement_type_events',
-        actual = 'number_of_community_stakeholder_engagement_type_events',
-        category = 'type_of_community_stakeholder_engagement_activity',
-        context = 'purpose_of_engagement',
-        sub_category = 'On-ground works',
-        object_class = 'Community Engagement',
-        property = 'on-ground works',
-        value = 'Total Events'),
-    sub_category_extract_context_no_species(
-        df_in = RLP_Data,
-        worksheet = 'RLP - Community e...tput Report',
-        service = 'Community/stakeholder engagement',
-        target_measure = 'Number of one-on-one technical advice interactions',
-        measured = 'number_of_community_stakeholder_engagement_type_events',
-        invoiced = 'number_of_community_stakeholder_engagement_type_events',
-        actual = 'number_of_community_stakeholder_engagement_type_events',
-        context = 'purpose_of_engagement',
-        category = 'type_of_community_stakeholder_engagement_activity',
-        sub_category = 'One-on-one technical advice interactions',
-        object_class = 'Community Engagement',
-        property = 'one-on-one technical advice interactions',
-        value = 'Total Events'),
-    sub_category_extract_context_no_species(
-        df_in = BR_Data,
-        worksheet = 'Community engagem...inal Report',
-        service = 'Community/stakeholder engagement',
-        target_measure = 'Number of one-on-one technical advice interactions',
-        measured = 'number_of_community_stakeholder_engagement_type_events',
-        invoiced = 'number_of_community_stakeholder_engagement_type_events',
-        actual = 'number_of_community_stakeholder_engagement_type_events',
-        category = 'type_of_community_stakeholder_engagement_activity',
-        sub_category = 'One-on-one technical advice interactions',
-        context = 'purpose_of_engagement',
-        object_class = 'Community Engagement',
-        property = 'one-on-one technical advice interactions',
-        value = 'Total Events'),
-    sub_category_extract_context_no_species(
-        df_in = RLP_Data,
-        worksheet = 'RLP - Community e...tput Report',
-        service = 'Community/stakeholder engagement',
-        target_measure = 'Number of training / workshop events',
-        measured = 'number_of_community_stakeholder_engagement_type_events',
-        invoiced = 'number_of_community_stakeholder_engagement_type_events',
-        actual = 'number_of_community_stakeholder_engagement_type_events',
-        category = 'type_of_community_stakeholder_engagement_activity',
-        context = 'purpose_of_engagement',
-        sub_category = 'Training / workshop events',
-        object_class = 'Community Engagement',
-        property = 'training / workshop events',
-        value = 'Total Events'),
-    sub_category_extract_context_no_species(
-        df_in = BR_Data,
-        worksheet = 'Community engagem...inal Report',
-        service = 'Community/stakeholder engagement',
-        target_measure = 'Number of training / workshop events',
-        measured = 'number_of_community_stakeholder_engagement_type_events',
-        invoiced = 'number_of_community_stakeholder_engagement_type_events',
-        actual = 'number_of_community_stakeholder_engagement_type_events',
-        category = 'type_of_community_stakeholder_engagement_activity',
-        sub_category = 'Training / workshop events',
-        context = 'purpose_of_engagement',
-        object_class = 'Community Engagement',
-        property = 'training / workshop events',
-        value = 'Total Events')])
-
-RLP_Data = load_mult_wbooks(['M02','M05','M07','M08','M09'],
-                             'RLP - Management ...tput Report')
-BR_Data = load_mult_wbooks(['M05'],'Management plan d...inal Report')
-
-report_raw = pd.concat([
-  report_raw,
-  no_category_extract_context_species(
-    df_in = RLP_Data,
-    worksheet = 'RLP - Management ...tput Report',
-    service = 'Developing farm/project/site management plan',
-    target_measure = 'Area (ha) covered by plan',
-    measured = 'calculatedareaha',
-    invoiced = 'areainvoicedha',
-    actual = 'area_ha_covered_by_plan_s',
-    context = 'type_of_plan',
-    species = 'species_and_or_threatened_ecological_communities_covered_in_plan',
-    object_class = 'Debris',
-    property = 'Removal',
-    value = 'Total Area (Ha)'),
-  no_category_extract_context_no_species(
-    df_in = RLP_Data,
-    worksheet = 'RLP - Management ...tput Report',
-    service = 'Developing farm/project/site management plan',
-    target_measure = 'Number of farm/project/site plans developed',
-    measured = 'number_of_plans_developed',
-    invoiced = 'number_of_plans_developed',
-    actual = 'number_of_plans_developed',
-    context = 'type_of_plan',
-    object_class = 'Debris',
-    property = 'Removal',
-    value = 'Total Plans'),
-  no_category_extract_context_no_species(
-    df_in = BR_Data,
-    worksheet = 'Management plan d...inal Report',
-    service = 'Developing farm/project/site management plan',
-    target_measure = 'Number of farm/project/site plans developed',
-    measured = 'number_of_plans_developed',
-    invoiced = 'number_of_plans_developed',
-    actual = 'number_of_plans_developed',
-    context = 'management_plan_type',
-    object_class = 'Debris',
-    property = 'Removal',
-    value = 'Total Plans')])
-
-adjustments_data = load_mult_wbooks('M09', 'RLP Output Report Adjustment')
-adjustments_data = adjustments_data[project_cols_in + report_cols_in + \
-                                    adjustment_cols]
-adjustments_data = adjustments_data.rename(columns={
-    'project_service':'service','output_measure':'target_measure'})
-adjustments_data['measured'] = np.nan
-adjustments_data['actual'] = \
-    adjustments_data['reported_measure_requiring_adjustment']
-adjustments_data['invoiced'] = adjustments_data['adjustment']
-adjustments_data['report_species'] = np.nan
-adjustments_data['category'] = np.nan
-adjustments_data['context'] = np.nan
-adjustments_data['sub_category'] = np.nan
-adjustments_data['meta_source_sheetname'] = 'RLP Output Report Adjustment' 
-adjustments_data['meta_transform_func'] = 'Adjustment Reports',
-adjustments_data['meta_col_measured'] = np.nan
-adjustments_data['meta_col_actual'] = 'reported_measure_requiring_adjustment',
-adjustments_data['meta_col_invoiced'] = 'adjustment',
-adjustments_data['meta_col_category'] = np.nan
-adjustments_data['meta_col_context'] = np.nan
-adjustments_data['meta_text_subcategory'] = np.nan
-adjustments_data['meta_col_report_species'] = np.nan
-adjustments_data['meta_line_item_object_class'] = np.nan
-adjustments_data[' meta_line_item_property'] = np.nan
-adjustments_data['meta_line_item_value'] = np.nan
-adjustments_data.drop(['reported_measure_requiring_adjustment','adjustment'],
-                      axis=1, inplace=True)
-adjustments_data = join_by_service_target_measure(adjustments_data,'service',
-                                                  'target_measure')
-report_raw = pd.concat([report_raw,adjustments_data])
-
-# Project Reports
-project_reports = report_raw.copy(deep=True)
-project_reports = project_reports.merge(management_units,
-                                        on='management_unit',
-                                        how='left')
-project_reports[
-    project_reports.total_to_be_delivered.isna()]['total_to_be_delivered'] =\
-    total_to_be_delivered_missing
-project_reports.loc[project_reports['report_status'] != 'Approved','invoiced'] = 0
-project_reports['extract_date'] = extract_date
-project_reports['MERIT_Reports_link'] = MERIT_Reports_link = \
-"https://fieldcapture.ala.org.au/project/index/"+project_reports['project_id']
-project_reports = project_reports.rename(
-    columns=\
-        {'status':'project_status', 'last_modified_1':'report_last_modified',
-         'stage':'report_stage','activity_id':'report_activity_id',
-          'activity_type':'report_activity_type','end_date':'project_end_date',
-          'start_date':'project_start_date','name':'project_name',
-          'contracted_start_date':'project_contracted_start_date',
-          'contracted_end_date':'project_contracted_end_date'})
-project_reports['version'] = version
-project_reports['meta_col_project_status'] ='status'
-project_reports['meta_col_report_last_modified'] ='last_modified_2'
-project_reports['meta_col_report_stage'] ='stage'
-project_reports['meta_col_report_activity_id'] ='activity_id'
-project_reports['meta_col_report_activity_type'] ='activity_type'
-project_reports['meta_col_project_start_date'] ='start_date'
-project_reports['meta_col_project_end_date'] ='end_date'
-project_reports['meta_col_project_contracted_start_date'] ='contracted_start_date'
-project_reports['meta_col_project_contracted_end_date'] ='contracted_end_date'
-project_reports['meta_col_project_name'] ='name'
-project_reports = project_reports[project_cols_out+report_cols_out+\
-                                  project_meta_cols_out+report_meta_cols_out+\
-                                  extract_date_cols]
-project_reports = project_reports[
-    (project_reports['measured'] != 0) |
-    (project_reports['actual'] != 0) |
-    (project_reports['invoiced'] != 0) &
-    (project_reports['report_status']=='Approved')]
-
-# Primary and Secondary Outcomes
-primary_secondary_outcomes = RLP_Outcomes.copy(deep=True)
-
-primary_secondary_outcomes = primary_secondary_outcomes[\
-primary_secondary_outcomes['type_of_outcomes'].
-isin(['Primary outcome','Secondary Outcome/s'])]\
-    [['merit_project_id','outcome']]
-primary_secondary_outcomes = conc_col(
-    primary_secondary_outcomes,'merit_project_id','outcome')
-primary_secondary_outcomes.rename(columns={'outcome':
-                                           'primary_secondary_outcomes'},
-                          inplace=True)
-
-# Primary Outcomes
-primary_outcomes = RLP_Outcomes.copy(deep=True)
-primary_outcomes = primary_outcomes[\
-primary_outcomes['type_of_outcomes'] =='Primary outcome']\
-    [['merit_project_id','outcome']]
-primary_outcomes = conc_col(
-    primary_outcomes,'merit_project_id','outcome')
-primary_outcomes.rename(columns={'outcome':'primary_outcomes'},
-                          inplace=True)
-
-# Secondary Outcomes
-secondary_outcomes = RLP_Outcomes.copy(deep=True)
-secondary_outcomes = secondary_outcomes[\
-secondary_outcomes['type_of_outcomes'] =='Secondary Outcome/s']\
-    [['merit_project_id','outcome']]
-secondary_outcomes = conc_col(
-    secondary_outcomes,'merit_project_id','outcome')
-secondary_outcomes.rename(columns={'outcome':'secondary_outcomes'},
-                          inplace=True)
-
-# Primary and Secondary Investment Priorities 
-primary_secondary_investment_priorities = RLP_Outcomes.copy(deep=True)
-
-primary_secondary_investment_priorities = primary_secondary_investment_priorities[\
-primary_secondary_investment_priorities['type_of_outcomes'].
-isin(['Primary outcome','Secondary Outcome/s'])]\
-    [['merit_project_id','investment_priority']]
-primary_secondary_investment_priorities = conc_col(
-    primary_secondary_investment_priorities,'merit_project_id',
-    'investment_priority')
-primary_secondary_investment_priorities.rename(columns=
-    {'investment_priority':'primary_secondary_investment_priorities'},
-    inplace=True)
-
-# Primary Investment Priorities
-primary_investment_priorities = RLP_Outcomes.copy(deep=True)
-primary_investment_priorities = primary_investment_priorities[\
-primary_investment_priorities['type_of_outcomes'] =='Primary outcome']\
-    [['merit_project_id','investment_priority']]
-primary_investment_priorities = conc_col(
-    primary_investment_priorities,'merit_project_id','investment_priority')
-primary_investment_priorities.rename(columns=
-    {'investment_priority':'primary_investment_priority'},
-    inplace=True)
-
-# Secondary Investment Priorities
-secondary_investment_priorities = RLP_Outcomes.copy(deep=True)
-secondary_investment_priorities = secondary_investment_priorities[\
-secondary_investment_priorities['type_of_outcomes'] =='Secondary Outcome/s']\
-    [['merit_project_id','investment_priority']]
-secondary_investment_priorities = conc_col(
-    secondary_investment_priorities,'merit_project_id','investment_priority')
-secondary_investment_priorities.rename(columns=
-    {'investment_priority':'secondary_investment_priority'},
-    inplace=True)
-
-# Project Assets
-project_assets = read_sheet('MERI_Project Assets','M01 '+extract_date+'.xlsx',
-                            start_row=0)[['merit_project_id','asset']]
-project_assets = conc_col(project_assets, 'merit_project_id','asset')
-project_assets.rename(columns={'asset':'assets'}, inplace=True)
-
-# Meri Outcomes Indicators
-meri_outcomes = read_sheet('MERI_Outcomes','M01 '+extract_date+'.xlsx',
-                            start_row=0)[['merit_project_id']+ \
-                                          meri_outcomes_indicator_ref].\
-                                         groupby('merit_project_id').\
-                                             tail(1)
-
-# Meri Outcomes Priorities
-meri_priorities = read_sheet('MERI_Priorities','M01 '+extract_date+'.xlsx',
-                            start_row=0)[['merit_project_id',
-                                          'document_name',
-                                          'relevant_section',
-                                          'explanation_of_strategic_alignment']]
-meri_priorities.drop_duplicates(inplace=True)
-meri_priorities = meri_priorities[~meri_priorities['document_name'].isnull()]
-meri_priorities['documents_priority'] = "name: " + \
-                meri_priorities['document_name'] + ' section: ' + \
-                meri_priorities['relevant_section'] +' alignment: '+ \
-                meri_priorities['explanation_of_strategic_alignment']
-                
-meri_priorities = meri_priorities[['merit_project_id','documents_priority']]
-meri_priorities = conc_col(meri_priorities,
-                           'merit_project_id',
-                           'documents_priority')
-
-reports_species = report_raw.copy(deep = True)                                   
-reports_species = reports_species[~reports_species['species'].isnull()]
-reports_species = reports_species[['merit_project_id','species']]
-reports_species = conc_col(reports_species,'merit_project_id','species')
-reports_species = reports_species.rename(columns={'species':'report_species'})
-
-reports_project_services = report_raw.copy(deep=True)
-reports_project_services = reports_project_services[['merit_project_id',
-                                                   'service','target_measure']]
-reports_project_services['report_project_services'] = reports_project_services[
-    'service'] +' - ' + reports_project_services['target_measure']
-reports_project_services = reports_project_services[['merit_project_id',
-                                                     'report_project_services']]
-reports_project_services = conc_col(reports_project_services,
-                                     'merit_project_id',
-                                     'report_project_services')
-
-# # load("sprat_lookup.Rdata")
-# # col_by_merit_project_id <- function(Data,col) {
-# #   fred <- Data %>% 
-# #     filter(!is.na({{ col }})) %>%
-# #     separate_rows({{ col }},sep='[,;|//\n]') %>% 
-# #     select(merit_project_id,{{ col}}) %>% 
-# #     drop_na() %>% 
-# #     mutate(merit_raw=str_trim( {{ col }})) %>% 
-# #     distinct() %>%
-# #     select(merit_project_id,merit_raw)
-# # }
-# # 
-# # merit_sprat_clean <- bind_rows(
-# #   col_by_merit_project_id(projects_species,assets),
-# #   col_by_merit_project_id(projects_species,primary_investment_priority),
-# #   col_by_merit_project_id(projects_species,secondary_investment_priority),
-# #   col_by_merit_project_id(projects_reports_species,report_species)) %>%
-# #   distinct() %>%
-# #   left_join(sprat_lookup,on='merit_raw') %>%
-# #   filter(!is.na(sprat_category)) %>%
-# #   distinct()
-
-projects_reports_species = project_reports.copy(deep=True)
-projects_reports_species = projects_reports_species.merge(
-    primary_secondary_investment_priorities,on='merit_project_id', how='left').\
-    merge(primary_investment_priorities,on='merit_project_id', how='left').\
-    merge(secondary_investment_priorities,on='merit_project_id', how='left').\
-    merge(project_assets,on='merit_project_id', how='left').\
-    merge(meri_outcomes,on='merit_project_id', how='left').\
-    merge(epbc,on='merit_project_id',how='left').\
-    merge(tec,on='merit_project_id',how='left').\
-    merge(ramsar,on='merit_project_id',how='left').\
-    merge(primary_secondary_outcomes,on='merit_project_id',how='left').\
-    merge(primary_outcomes,on='merit_project_id',how='left').\
-    merge(secondary_outcomes,on='merit_project_id',how='left').\
-    merge(meri_priorities,on='merit_project_id',how='left')
-projects_reports_species['meta_col_project_status'] = 'status'
-projects_reports_species['meta_col_project_start_date'] = 'start_date'
-projects_reports_species['meta_col_project_end_date'] = 'end_date'
-projects_reports_species['meta_col_project_contracted_start_date'] = \
-    'contracted_start_date'
-projects_reports_species['meta_col_project_contracted_end_date'] = \
-                                          'contracted_end_date'
-projects_reports_species['meta_col_project_name'] = 'name'
-projects_reports_species = projects_reports_species[
-    project_cols_out + report_cols_out + \
-    project_meta_cols_out + report_meta_cols_out + \
-    species_etc_cols_out + extract_date_cols]
-
-
-projects_species = projects.copy(deep=True)
-projects_species = projects_species.merge(
-    primary_secondary_investment_priorities,on='merit_project_id', how='left').\
-    merge(primary_investment_priorities,on='merit_project_id', how='left').\
-    merge(secondary_investment_priorities,on='merit_project_id', how='left').\
-    merge(project_assets,on='merit_project_id', how='left').\
-    merge(meri_outcomes,on='merit_project_id', how='left').\
-    merge(epbc,on='merit_project_id',how='left').\
-    merge(tec,on='merit_project_id',how='left').\
-    merge(ramsar,on='merit_project_id',how='left').\
-    merge(primary_secondary_outcomes,on='merit_project_id',how='left').\
-    merge(primary_outcomes,on='merit_project_id',how='left').\
-    merge(secondary_outcomes,on='merit_project_id',how='left').\
-    merge(meri_priorities,on='merit_project_id',how='left').\
-    merge(management_units,on='management_unit',how='left').\
-    merge(reports_project_services,on='merit_project_id',how='left').\
-    merge(reports_species,on='merit_project_id',how='left')
-projects_species['meta_col_project_status'] = 'status'
-projects_species['extract_date'] = extract_date
-projects_species['version'] = version
-projects_species['grant_or_procurement'] = np.nan
-projects_species['meta_col_project_start_date'] = 'start_date'
-projects_species['meta_col_project_end_date'] = 'end_date'
-projects_species['meta_col_project_contracted_start_date'] = \
-    'contracted_start_date'
-projects_species['meta_col_project_contracted_end_date'] = \
-                                          'contracted_end_date'
-projects_species['meta_col_project_name'] = 'name'
-
-projects_species.rename(columns={
-    'status':'project_status',
-    'start_date':'project_start_date',
-    'end_date':'project_end_date',
-    'contracted_start_date':'project_contracted_start_date',
-    'contracted_end_date':'project_contracted_end_date',
-    'name':'project_name'},inplace=True)
-
-project_species = projects_species[project_cols_out + ['service_provider', \
-                                   'report_project_services'] + \
-                                   species_etc_cols_out +\
-                                       extract_date_cols]    
-    
+@pipeline_stage('project_services',inputs=['m01_sheets','lookups'])
+def stage_project_services(m01_sheets:dict,lookups:dict) -> pd.DataFrame:
+    """
+    Project services and targets by financial year, the SGE grid plus the
+    RLP targets. In lazy_service_grid mode a ServiceTable, the grid only
+    expanded when it is exported or joined.
+    Parameters
+    ----------
+    m01_sheets : dict
+        output of the m01_sheets stage.
+    lookups : dict
+        output of the lookups stage.
+    Returns
+    -------
+    project_services : pd.DataFrame
+        project services, or a ServiceTable.
+    """
+    project_services_RLP = pd.melt(m01_sheets['project_services_RLP'],
+                                   id_vars = \
+                                   ['merit_project_id','service',
+                                    'target_measure','total_to_be_delivered'],
+                                   var_name='report_financial_year',
+                                   value_name='fy_target')
+     
+    project_services_RLP.report_financial_year = project_services_RLP.\
+        report_financial_year.\
+            replace('[_]','/',regex=True)
+
+    grid = ids_by_df(sge_ids(m01_sheets['projects']),
+                     lookups['all_project_services'],financial_years,
+                     lazy=lazy_service_grid)
+    if lazy_service_grid:
+        return ServiceTable(grid,concat_frames([project_services_RLP]))
+    return concat_frames([grid,project_services_RLP])
+
+
+def report_families(m01_sheets:dict,lookups:dict,
+                    project_services:pd.DataFrame):
+    """
+    Report rows of every extract spec and of the adjustments, a worksheet
+    family at a time, on a pool of family_workers processes
+    Parameters
+    ----------
+    m01_sheets : dict
+        output of the m01_sheets stage.
+    lookups : dict
+        output of the lookups stage.
+    project_services : pd.DataFrame
+        output of the project_services stage.
+    Yields
+    ------
+    df_family : pd.DataFrame
+        report rows of the next family, in family order.
+    """
+    projects = m01_sheets['projects']
+    all_project_services = lookups['all_project_services']
+    if isinstance(project_services,ServiceTable):
+        services = ProjectServices(project_services.df,project_services.grid)
+        # the grid is covered by projects and all_project_services
+        project_services = project_services.df
+    else:
+        services = ProjectServices(project_services)
+
+    context = {'services':services,'projects':projects,
+               'project_services':project_services,
+               'all_project_services':all_project_services}
+    families = worksheet_families + [adjustment_family]
+    # pool workers read their M files one at a time
+    pool = process_pool(min(family_workers,len(families)),set_family_context,
+                        (dict(context,ingest_workers=1),))
+    if pool is None:
+        set_family_context(dict(context,ingest_workers=None))
+        try:
+            for worksheet_family in families:
+                yield run_family(worksheet_family)
+        finally:
+            _family_context.clear()
+    else:
+        with pool:
+            for df_family, records in pool.map(
+                    profiled_call,itertools.repeat('run_family'),families):
+                _profile_records.extend(records)
+                yield df_family
+
+
+@pipeline_stage('report_raw',inputs=['m01_sheets','lookups',
+                                     'project_services'],
+                files=lambda: sorted(set(
+                    file_spec + ' ' + extract_date + '.xlsx'
+                    for files_list in worksheet_files.values()
+                    for file_spec in files_list)))
+def stage_report_raw(m01_sheets:dict,lookups:dict,
+                     project_services:pd.DataFrame) -> pd.DataFrame:
+    """
+    Report rows of every extract spec and of the adjustments
+    Parameters
+    ----------
+    m01_sheets : dict
+        output of the m01_sheets stage.
+    lookups : dict
+        output of the lookups stage.
+    project_services : pd.DataFrame
+        output of the project_services stage.
+    Returns
+    -------
+    report_raw : pd.DataFrame
+        report rows.
+    """
+    report_acc = ReportAccumulator()
+    report_acc.extend(report_families(m01_sheets,lookups,project_services))
+    return report_acc.to_frame()
 
 
+@pipeline_stage('project_reports',inputs=['report_raw','lookups'])
+def stage_project_reports(report_raw:pd.DataFrame,
+                          lookups:dict) -> pd.DataFrame:
+    """
+    Report rows with management units, renamed for output and filtered to
+    reported values
+    Parameters
+    ----------
+    report_raw : pd.DataFrame
+        output of the report_raw stage.
+    lookups : dict
+        output of the lookups stage.
+    Returns
+    -------
+    project_reports : pd.DataFrame
+        project reports.
+    """
+    project_reports = report_raw.copy(deep=True)
+    project_reports = project_reports.merge(lookups['management_units'],
+                                            on='management_unit',
+                                            how='left')
+    project_reports[
+        project_reports.total_to_be_delivered.isna()]\
+        ['total_to_be_delivered'] = total_to_be_delivered_missing
+    project_reports.loc[project_reports['report_status'] != 'Approved',
+                        'invoiced'] = 0
+    project_reports['extract_date'] = extract_date
+    project_reports['MERIT_Reports_link'] = \
+    "https://fieldcapture.ala.org.au/project/index/"+project_reports['project_id']
+    project_reports = project_reports.rename(
+        columns=\
+            {'status':'project_status', 'last_modified_1':'report_last_modified',
+             'stage':'report_stage','activity_id':'report_activity_id',
+              'activity_type':'report_activity_type','end_date':'project_end_date',
+              'start_date':'project_start_date','name':'project_name',
+              'contracted_start_date':'project_contracted_start_date',
+              'contracted_end_date':'project_contracted_end_date'})
+    project_reports['version'] = version
+    if not compact_lineage:
+        for meta_col,source_col in project_meta_values.items():
+            project_reports[meta_col] = source_col
+    project_reports = project_reports[lineage_cols(
+        lineage_tables['project_reports'])]
+    return project_reports[
+        (project_reports['measured'] != 0) |
+        (project_reports['actual'] != 0) |
+        (project_reports['invoiced'] != 0) &
+        (project_reports['report_status']=='Approved')]
+
+
+@pipeline_stage('project_attrs',inputs=['m01_sheets','lookups','report_raw'])
+def stage_project_attrs(m01_sheets:dict,lookups:dict,
+                        report_raw:pd.DataFrame) -> pd.DataFrame:
+    """
+    Per project attributes: outcomes, investment priorities, assets, MERI
+    outcomes and priorities, indicators and the reported services and
+    species.
+    Parameters
+    ----------
+    m01_sheets : dict
+        output of the m01_sheets stage.
+    lookups : dict
+        output of the lookups stage.
+    report_raw : pd.DataFrame
+        output of the report_raw stage.
+    Returns
+    -------
+    project_attrs : pd.DataFrame
+        attributes indexed by merit_project_id.
+    """
+    RLP_Outcomes = m01_sheets['RLP_Outcomes']
+    RLP_Outcomes_investment_priority = \
+        split_col_to_rows(RLP_Outcomes,'investment_priority',',')
+    RLP_Outcomes_investment_priority= \
+            pd.merge(RLP_Outcomes_investment_priority,
+                     lookups['investment_priority_themes'],
+                     how='left',on='investment_priority')
+        
+    epbc = get_indicator(RLP_Outcomes_investment_priority,
+                         'epbc','Threatened Species')  
+
+    tec = get_indicator(RLP_Outcomes_investment_priority,
+                         'tec','Threatened Ecological Community')     
+
+    ramsar = get_indicator(RLP_Outcomes_investment_priority,
+                         'ramsar','Ramsar')    
+
+    # Primary and Secondary Outcomes and Investment Priorities
+    if incremental:
+        rlp_outcomes_summary = incremental_update(
+            state_name('rlp_outcomes_summary',code=[outcomes_summary]),
+            {'RLP_Outcomes':RLP_Outcomes},
+            lambda inputs: outcomes_summary(inputs['RLP_Outcomes']))
+    else:
+        rlp_outcomes_summary = outcomes_summary(RLP_Outcomes)
+
+    # Project Assets
+    project_assets = conc_col(m01_sheets['project_assets'],
+                              'merit_project_id','asset')
+    project_assets.rename(columns={'asset':'assets'}, inplace=True)
+
+    # Meri Outcomes Indicators
+    meri_outcomes = m01_sheets['meri_outcomes'].\
+        groupby('merit_project_id').tail(1)
+
+    # Meri Outcomes Priorities
+    meri_priorities = m01_sheets['meri_priorities'].drop_duplicates()
+    meri_priorities = meri_priorities[
+        ~meri_priorities['document_name'].isnull()]
+    meri_priorities['documents_priority'] = "name: " + \
+                    meri_priorities['document_name'] + ' section: ' + \
+                    meri_priorities['relevant_section'] +' alignment: '+ \
+                    meri_priorities['explanation_of_strategic_alignment']
+                    
+    meri_priorities = meri_priorities[['merit_project_id',
+                                       'documents_priority']]
+    meri_priorities = conc_col(meri_priorities,
+                               'merit_project_id',
+                               'documents_priority')
+
+    reports_species = split_col_to_rows(
+        report_raw[['merit_project_id','species']],'species')
+    reports_project_services = pd.DataFrame(
+        {'merit_project_id':report_raw['merit_project_id'],
+         'report_project_services':report_raw['service'].astype(object) + \
+             ' - ' + report_raw['target_measure'].astype(object)})
+    if incremental:
+        reports_species = incremental_update(
+            state_name('reports_species',code=[conc_col]),
+            {'species':reports_species},
+            lambda inputs: conc_col(inputs['species'],'merit_project_id',
+                                    'species'))
+        reports_project_services = incremental_update(
+            state_name('reports_project_services',code=[conc_col]),
+            {'services':reports_project_services},
+            lambda inputs: conc_col(inputs['services'],'merit_project_id',
+                                    'report_project_services'))
+    else:
+        reports_species = conc_col(reports_species,'merit_project_id',
+                                   'species')
+        reports_project_services = conc_col(reports_project_services,
+                                             'merit_project_id',
+                                             'report_project_services')
+    reports_species = reports_species.rename(
+        columns={'species':'report_species'})
+
+    # # load("sprat_lookup.Rdata")
+    # # col_by_merit_project_id <- function(Data,col) {
+    # #   fred <- Data %>% 
+    # #     filter(!is.na({{ col }})) %>%
+    # #     separate_rows({{ col }},sep='[,;|//\n]') %>% 
+    # #     select(merit_project_id,{{ col}}) %>% 
+    # #     drop_na() %>% 
+    # #     mutate(merit_raw=str_trim( {{ col }})) %>% 
+    # #     distinct() %>%
+    # #     select(merit_project_id,merit_raw)
+    # # }
+    # # 
+    # # merit_sprat_clean <- bind_rows(
+    # #   col_by_merit_project_id(projects_species,assets),
+    # #   col_by_merit_project_id(projects_species,primary_investment_priority),
+    # #   col_by_merit_project_id(projects_species,secondary_investment_priority),
+    # #   col_by_merit_project_id(projects_reports_species,report_species)) %>%
+    # #   distinct() %>%
+    # #   left_join(sprat_lookup,on='merit_raw') %>%
+    # #   filter(!is.na(sprat_category)) %>%
+    # #   distinct()
+
+    # Project attributes - built once, joined to each output
+    return project_attributes([
+        rlp_outcomes_summary,
+        project_assets,
+        meri_outcomes,
+        epbc,
+        tec,
+        ramsar,
+        meri_priorities,
+        reports_project_services,
+        reports_species])
+
+
+@pipeline_stage('projects_reports_species',
+                inputs=['project_reports','project_attrs'])
+def stage_projects_reports_species(project_reports:pd.DataFrame,
+                                   project_attrs:pd.DataFrame
+                                   ) -> pd.DataFrame:
+    """
+    Project reports with the project attributes
+    Parameters
+    ----------
+    project_reports : pd.DataFrame
+        output of the project_reports stage.
+    project_attrs : pd.DataFrame
+        output of the project_attrs stage.
+    Returns
+    -------
+    projects_reports_species : pd.DataFrame
+        projects reports species.
+    """
+    projects_reports_species = join_project_attributes(
+        project_reports,
+        project_attrs.drop(columns=['report_project_services',
+                                    'report_species']))
+    return projects_reports_species[lineage_cols(
+        lineage_tables['projects_reports_species'])]
+
+
+@pipeline_stage('project_species',
+                inputs=['m01_sheets','lookups','project_attrs'])
+def stage_project_species(m01_sheets:dict,lookups:dict,
+                          project_attrs:pd.DataFrame) -> pd.DataFrame:
+    """
+    Projects with the project attributes
+    Parameters
+    ----------
+    m01_sheets : dict
+        output of the m01_sheets stage.
+    lookups : dict
+        output of the lookups stage.
+    project_attrs : pd.DataFrame
+        output of the project_attrs stage.
+    Returns
+    -------
+    project_species : pd.DataFrame
+        project species.
+    """
+    projects_species = join_project_attributes(m01_sheets['projects'],
+                                               project_attrs).\
+        merge(lookups['management_units'],on='management_unit',how='left')
+    projects_species['meta_col_project_status'] = 'status'
+    projects_species['extract_date'] = extract_date
+    projects_species['version'] = version
+    projects_species['grant_or_procurement'] = np.nan
+    projects_species['meta_col_project_start_date'] = 'start_date'
+    projects_species['meta_col_project_end_date'] = 'end_date'
+    projects_species['meta_col_project_contracted_start_date'] = \
+        'contracted_start_date'
+    projects_species['meta_col_project_contracted_end_date'] = \
+                                              'contracted_end_date'
+    projects_species['meta_col_project_name'] = 'name'
+
+    projects_species.rename(columns={
+        'status':'project_status',
+        'start_date':'project_start_date',
+        'end_date':'project_end_date',
+        'contracted_start_date':'project_contracted_start_date',
+        'contracted_end_date':'project_contracted_end_date',
+        'name':'project_name'},inplace=True)
+
+    return projects_species[project_cols_out + ['service_provider', \
+                            'report_project_services'] + \
+                            species_etc_cols_out + extract_date_cols]
+
+
+pipeline_targets = ['project_services','report_raw','project_reports',
+                    'projects_reports_species','project_species','lookups']
+
+if __name__ == '__main__':
+    stage_outputs = run_out_of_core(pipeline_targets) if out_of_core else \
+        run_stages(pipeline_targets)
+    project_services = stage_outputs['project_services']
+    report_raw = stage_outputs['report_raw']
+    project_reports = stage_outputs['project_reports']
+    projects_reports_species = stage_outputs['projects_reports_species']
+    project_species = stage_outputs['project_species']
+    if check_backend:
+        for name,difference in check_backends(pipeline_targets).items():
+            print(name,'same' if difference is None else difference)
+    close_ingest_pools()
+    if export_parquet_files:
+        export_outputs(stage_outputs)
+    if export_excel:
+        export_workbook(stage_outputs)
+    if export_sqlite:
+        export_database(stage_outputs)
+    if profile_calls:
+        print(profile_summary().to_string())
+        print(profile_summary(zero_rows=True).to_string())
+        print('Profile written to',write_profile())
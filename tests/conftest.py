@@ -0,0 +1,42 @@
+"""
+Fixtures running big_download_poc on synthetic workbooks from
+big_download_bench
+"""
+
+import os
+import sys
+import shutil
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import big_download_poc as bdp
+import big_download_bench as bench
+
+test_projects = 10
+
+
+@pytest.fixture(scope='session')
+def generated_dir(tmp_path_factory) -> str:
+    """
+    Synthetic workbooks and lookups, generated once per session
+    """
+    data_dir = str(tmp_path_factory.mktemp('generated'))
+    bench.generate_workbooks(data_dir,test_projects,0)
+    return data_dir
+
+
+@pytest.fixture
+def data_dir(generated_dir,tmp_path,monkeypatch) -> str:
+    """
+    A copy of the synthetic data as the working directory, with the stage
+    cache off and reads in this process
+    """
+    data_dir = str(tmp_path / 'data')
+    shutil.copytree(generated_dir,data_dir)
+    monkeypatch.chdir(data_dir)
+    monkeypatch.setattr(bdp,'use_stage_cache',False)
+    monkeypatch.setattr(bdp,'ingest_workers',1)
+    monkeypatch.setattr(bdp,'family_workers',1)
+    return data_dir
@@ -0,0 +1,117 @@
+"""
+Incremental mode of big_download_poc
+"""
+
+import os
+
+import openpyxl
+import pandas as pd
+
+import big_download_poc as bdp
+
+
+def run_targets(monkeypatch,incremental:bool) -> dict:
+    """
+    Runs the pipeline targets with incremental mode on or off
+    """
+    monkeypatch.setattr(bdp,'incremental',incremental)
+    return bdp.run_stages(bdp.pipeline_targets)
+
+
+def assert_same_outputs(outputs:dict,reference:dict):
+    """
+    Asserts the outputs hold the reference rows, in any order
+    """
+    for name in bdp.pipeline_targets:
+        difference = bdp.frames_difference(reference[name],outputs[name])
+        assert difference in [None,'same rows in a different order'], \
+            name + ': ' + difference
+
+
+def test_incremental_missing_worksheet(data_dir,monkeypatch):
+    # catalogue worksheets the synthetic M files do not have
+    missing = [
+        sheet_name for sheet_name,files_list in bdp.worksheet_files.items()
+        if not any(sheet_name in bdp.workbook_sheets(
+            file_spec + ' ' + bdp.extract_date + '.xlsx')
+                   for file_spec in files_list)]
+    assert missing
+    reference = run_targets(monkeypatch,False)
+    assert_same_outputs(run_targets(monkeypatch,True),reference)
+
+
+def extract_rows_in(monkeypatch,incremental:bool) -> tuple:
+    """
+    Runs the pipeline targets profiled, returning the outputs and the
+    worksheet rows the extracts were run on
+    """
+    monkeypatch.setattr(bdp,'profile_calls',True)
+    bdp._profile_records.clear()
+    outputs = run_targets(monkeypatch,incremental)
+    rows_in = sum(record['rows_in'] for record in bdp._profile_records
+                  if record['call'] == 'extract_group')
+    bdp._profile_records.clear()
+    return outputs, rows_in
+
+
+def change_project(sheet_name:str,col:str) -> str:
+    """
+    Adds one to col in the first report row of a worksheet, in the first M
+    file with the worksheet, returning the project changed
+    """
+    file_spec = next(
+        file_spec for file_spec in bdp.worksheet_files[sheet_name]
+        if sheet_name in bdp.workbook_sheets(
+            file_spec + ' ' + bdp.extract_date + '.xlsx'))
+    fname = file_spec + ' ' + bdp.extract_date + '.xlsx'
+    workbook = openpyxl.load_workbook(fname)
+    worksheet = workbook[sheet_name]
+    headings = [cell.value for cell in worksheet[3]]
+    cell = worksheet.cell(4,headings.index(col) + 1)
+    cell.value += 1
+    project_id = worksheet.cell(4,headings.index('Grant ID') + 1).value
+    workbook.save(fname)
+    return project_id
+
+
+def test_incremental_reruns(data_dir,monkeypatch):
+    # first run: every project computed and saved
+    outputs, first_rows_in = extract_rows_in(monkeypatch,True)
+    assert_same_outputs(outputs,run_targets(monkeypatch,False))
+    assert first_rows_in > 0
+    assert os.listdir(bdp.incremental_state_dir)
+
+    # rerun with no changes: the saved rows, no extracts run
+    outputs, rows_in = extract_rows_in(monkeypatch,True)
+    assert_same_outputs(outputs,run_targets(monkeypatch,False))
+    assert rows_in == 0
+
+    # rerun after a changed project: only its rows extracted again
+    change_project('RLP - Baseline da...tput Report',
+                   'Number of baseline data sets collected and/or '
+                   'synthesised')
+    outputs, rows_in = extract_rows_in(monkeypatch,True)
+    assert_same_outputs(outputs,run_targets(monkeypatch,False))
+    assert 0 < rows_in < first_rows_in
+
+
+def test_incremental_update_empty_state(tmp_path,monkeypatch):
+    monkeypatch.setattr(bdp,'incremental_state_dir',str(tmp_path))
+    inputs = {'rows':pd.DataFrame({'merit_project_id':['a','b'],
+                                   'value':[1,2]})}
+    for _ in range(2):
+        df_out = bdp.incremental_update('empty',inputs,
+                                        lambda inputs: pd.DataFrame())
+        assert df_out.shape[0] == 0
+    inputs['rows'].loc[0,'value'] = 3
+    df_out = bdp.incremental_update(
+        'empty',inputs,lambda inputs: inputs['rows'])
+    assert list(df_out['merit_project_id']) == ['a']
+
+
+def test_state_name_code(monkeypatch):
+    name = bdp.state_name('report_rows',code=[bdp.extract_batch])
+    assert name == bdp.state_name('report_rows',code=[bdp.extract_batch])
+    # a change anywhere in the extract_batch call chain
+    monkeypatch.setattr(bdp,'extract_group',lambda *args,**kwargs: None)
+    assert name != bdp.state_name('report_rows',code=[bdp.extract_batch])